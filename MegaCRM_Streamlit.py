@@ -6,14 +6,24 @@
 # + تاريخ ميلاد العميل + تنبيه أعياد الميلاد
 # + تقرير يومي عبر WhatsApp للإدارة مع الملاحظات كاملة
 
-import json, urllib.parse, time
+import json, os, urllib.parse, time, threading
 import streamlit as st
 import pandas as pd
 import gspread
 import gspread.exceptions as gse
 from google.oauth2.service_account import Credentials
-from datetime import datetime, date, timedelta, timezone
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from datetime import datetime, date, timedelta
+
+from megacrm_core import (
+    ARCHIVE_SUFFIX, EXPECTED_HEADERS, GATEWAY, PICKER_TOP_K, REASSIGN_LOG_HEADERS,
+    REASSIGN_LOG_SHEET, SheetStore, SheetsStorage, SheetsSync, SheetsWriter, SqliteStorage,
+    build_client_index, count_api_calls, enable_profiler, find_client_row, fmt_date,
+    format_display_phone, move_client, normalize_tn_phone, open_spreadsheet, parse_log_ts,
+    process_started_at, profiled, search_client_index, search_phone, table_styles, timed,
+)
+# cold start = من بداية العملية (السيرفر، قبل imports streamlit) لين يكمل أوّل render
+STARTUP_BUDGET_MS = float(os.environ.get("MEGACRM_STARTUP_BUDGET_MS", 2500))
 
 # ============ إعداد الصفحة ============
 st.set_page_config(page_title="MegaCRM", layout="wide", initial_sidebar_state="expanded")
@@ -120,152 +130,267 @@ def make_client_and_sheet_id():
         sheet_id = "PUT_YOUR_SHEET_ID_HERE"
         return client, sheet_id
 
-client, SPREADSHEET_ID = make_client_and_sheet_id()
-
-# ============ ثوابت الجداول ============
-EXPECTED_HEADERS = [
-    "Nom & Prénom",      # 0
-    "Téléphone",         # 1
-    "Date de naissance", # 2
-    "Type de contact",   # 3
-    "Formation",         # 4
-    "Remarque",          # 5
-    "Date ajout",        # 6
-    "Date de suivi",     # 7
-    "Alerte",            # 8
-    "Inscription",       # 9
-    "Employe",           # 10
-    "Tag",               # 11,
-]
-
-REASSIGN_LOG_SHEET   = "Reassign_Log"
-REASSIGN_LOG_HEADERS = ["timestamp","moved_by","src_employee","dst_employee","client_name","phone"]
+def secret(name: str, default=None):
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+GS_POOL_SIZE = 20  # connections HTTP مشتركة بين الجلسات والـ threads
+
+@st.cache_resource(show_spinner=False)
+def get_client_and_sheet_id():
+    """client وحيد للعملية: credentials وحدة (الـ token يتجدّد هنا برك) + session HTTP فيها pool.
+
+    الـ auth يصير كان وقت نحتاجو Google Sheets (SQLite وحدو يخدم offline).
+    """
+    client, sheet_id = make_client_and_sheet_id()
+    # gspread 6: client.http_client.session — gspread 5: client.session
+    session = getattr(getattr(client, "http_client", client), "session", None)
+    if session is not None:
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GS_POOL_SIZE)
+        session.mount("https://", adapter)
+    return client, sheet_id
+
+# "sheets" (Google Sheets مباشرة) ولا "sqlite" (محلي + مزامنة مع Google Sheets)
+STORAGE_BACKEND = os.environ.get("MEGACRM_STORAGE") or secret("storage_backend", "sheets")
+SQLITE_PATH = os.environ.get("MEGACRM_SQLITE") or secret("sqlite_path", "megacrm.db")
 
 # ============ Helpers ============
-def fmt_date(d: date | None) -> str:
-    return d.strftime("%d/%m/%Y") if isinstance(d, date) else ""
-
-def normalize_tn_phone(s: str) -> str:
-    digits = "".join(ch for ch in str(s) if ch.isdigit())
-    if digits.startswith("216"):
-        return digits
-    if len(digits) == 8:
-        return "216" + digits
-    return digits
-
-def format_display_phone(s: str) -> str:
-    d = "".join(ch for ch in str(s) if ch.isdigit())
-    return f"+{d}" if d else ""
-
-def color_tag(val):
-    if isinstance(val, str) and val.strip().startswith("#") and len(val.strip()) == 7:
-        return f"background-color: {val}; color: white;"
-    return ""
-
-def mark_alert_cell(val: str):
-    s = str(val).strip()
-    if not s:
-        return ""
-    if "متأخر" in s:
-        return "background-color:#ffe6b3;color:#7a4e00"
-    return "background-color:#ffcccc;color:#7a0000"
-
-def highlight_inscrit_row(row: pd.Series):
-    insc = str(row.get("Inscription", "")).strip().lower()
-    return ["background-color:#d6f5e8" if insc in ("inscrit", "oui") else "" for _ in row.index]
-
-# ===================== Sheets Utils (Backoff + Cache) =====================
+TABLE_PAGE_SIZES = [25, 50, 100, 200]
+
+def render_table(df_disp: pd.DataFrame, key: str):
+    """جدول عملاء مقسوم صفحات: الستايل يتحسب للصفحة الظاهرة برك."""
+    if df_disp.empty:
+        st.info("لا توجد بيانات.")
+        return
+    n = len(df_disp)
+    c1, c2, c3 = st.columns([1, 1, 2])
+    page_size = c1.selectbox(
+        "عدد الأسطر", TABLE_PAGE_SIZES, index=1, key=f"{key}::page_size"
+    )
+    pages = -(-n // page_size)
+    page_no = (
+        c2.number_input("الصفحة", 1, pages, 1, key=f"{key}::page::{pages}")
+        if pages > 1
+        else 1
+    )
+    c3.caption(f"{n} عميل — صفحة {page_no}/{pages}")
+
+    start = (int(page_no) - 1) * page_size
+    page = df_disp.iloc[start : start + page_size]
+    if "Alerte_view" in page.columns:
+        page = page.assign(Alerte=page["Alerte_view"])
+    view = page[[c for c in EXPECTED_HEADERS if c in page.columns]]
+    st.dataframe(
+        view.style.apply(table_styles, axis=None),
+        use_container_width=True,
+    )
+
+def client_picker(label: str, key: str, df: pd.DataFrame, title: str | None = None) -> str | None:
+    """اختيار عميل بالبحث (اسم/هاتف): يرجّع الهاتف المنظّف، موش نصّ العرض.
+
+    title: ورقة في الكاش → الفهرس يتعاود استعمالو؛ df هو النطاق (مثلاً شهر مفلتر).
+    """
+    store = get_sheet_store()
+    entry = store.frames.get(title) if title else None
+    tokens, labels = (
+        store.client_index(title) if entry is not None else build_client_index(df)
+    )
+    query = st.text_input(
+        f"🔎 {label}", key=f"{key}::q", placeholder="اكتب جزء من الاسم أو الرقم"
+    )
+    phones = df["Téléphone_norm"]
+    if query.strip():
+        full_scope = entry is not None and len(df) == len(entry[1])
+        scope = None if full_scope else set(phones)
+        matches = search_client_index(tokens, query, scope=scope)
+    else:
+        matches = list(dict.fromkeys(phones[phones.ne("")].head(PICKER_TOP_K)))
+    if not matches:
+        st.caption("❕ لا توجد نتائج.")
+        return None
+    return st.selectbox(label, matches, format_func=lambda ph: labels.get(ph, ph), key=key)
+
+# ============ Profiling (مخفي، مطفي بشكل افتراضي) ============
+# MEGACRM_PROFILE=1 ولا profile = true في secrets. مطفي → PROFILER = None والـ decorators ما يلفّو شي.
+PROFILE_ENABLED = bool(os.environ.get("MEGACRM_PROFILE") or secret("profile", False))
+PROFILER = enable_profiler() if PROFILE_ENABLED else None
+
+# ============ Google Sheets + سجلّ النقل ============
+@st.cache_resource(show_spinner=False)
 def get_spreadsheet():
-    if st.session_state.get("sh_id") == SPREADSHEET_ID and "sh_obj" in st.session_state:
-        return st.session_state["sh_obj"]
-    last_err = None
-    for i in range(5):
-        try:
-            sh = client.open_by_key(SPREADSHEET_ID)
-            st.session_state["sh_obj"] = sh
-            st.session_state["sh_id"] = SPREADSHEET_ID
-            return sh
-        except gse.APIError as e:
-            last_err = e
-            time.sleep(0.5 * (2**i))
-    st.error("تعذر فتح Google Sheet (ربما الكوتا تعدّت).")
-    raise last_err
-
-def ensure_ws(title: str, columns: list[str]):
-    sh = get_spreadsheet()
+    """open_by_key (+ الـ metadata) مرّة وحدة للعملية، موش لكل جلسة."""
+    client, sheet_id = get_client_and_sheet_id()
+    return open_spreadsheet(client, sheet_id)
+
+LOG_PAGE_SIZE = 100  # صفوف السجلّ في كل قراية
+
+def reassign_log_rows(storage, more: bool = False, since: date | None = None):
+    """(صفوف السجلّ المحمّلة بالترتيب، فمّا صفوف أقدم؟) بقرايات محدودة من لوطة الورقة.
+
+    الصفوف تتخزّن في الجلسة: كل rerun يجيب كان الجديد (بعد آخر صف)، والصفحات
+    الأقدم تتقرا كان بـ more؛ since أقدم من اللي محمّل → نلقاو الحدّ بـ first_row_from
+    (بحث في العمود المرتّب) ونقراو الناقص في قراية وحدة.
+    """
+    last = storage.last_row(REASSIGN_LOG_SHEET)
+    cache = st.session_state.get("reassign_log")
+    if cache is None or last < cache["last"]:  # أول مرّة ولا السجلّ تقصّ
+        first = max(2, last - LOG_PAGE_SIZE + 1)
+        rows = storage.read_rows(REASSIGN_LOG_SHEET, first, last) if last >= 2 else []
+        cache = {"last": last, "first": first, "rows": rows}
+    elif last > cache["last"]:
+        cache["rows"] += storage.read_rows(REASSIGN_LOG_SHEET, cache["last"] + 1, last)
+        cache["last"] = last
+
+    def older():
+        first = max(2, cache["first"] - LOG_PAGE_SIZE)
+        cache["rows"] = storage.read_rows(REASSIGN_LOG_SHEET, first, cache["first"] - 1) + cache["rows"]
+        cache["first"] = first
+
+    if more and cache["first"] > 2:
+        older()
+    def oldest() -> str:
+        return cache["rows"][0][0] if cache["rows"] and cache["rows"][0] else ""
+
+    if since is not None and cache["first"] > 2 and oldest()[:10] >= since.isoformat():
+        # السجلّ append-only → الـ timestamps (ISO) مرتّبة، نقارنو النص مباشرة
+        end = cache["first"] - 1
+        first = storage.first_row_from(REASSIGN_LOG_SHEET, since.isoformat(), end)
+        if first <= end:
+            cache["rows"] = storage.read_rows(REASSIGN_LOG_SHEET, first, end) + cache["rows"]
+            cache["first"] = first
+    st.session_state["reassign_log"] = cache
+    return cache["rows"], cache["first"] > 2
+
+@st.cache_resource
+def get_sheet_store() -> SheetStore:
+    return SheetStore()
+
+@st.cache_resource
+def get_sqlite_storage() -> SqliteStorage:
+    return SqliteStorage(SQLITE_PATH)
+
+SYNC_RETRY_SECS = 60  # offline: نعاودو نجرّبو Google Sheets بعد هالمدّة، موش في كل rerun
+
+@st.cache_resource
+def sheets_sync_state() -> dict:
+    return {"sync": None, "at": 0.0, "lock": threading.Lock()}
+
+def get_sheets_sync() -> SheetsSync | None:
+    """thread وحيد للعملية يعمل push/pull مع Google Sheets. None = نخدمو offline.
+
+    الفشل ما يتكاشاش: بعد SYNC_RETRY_SECS نعاودو نجرّبو نتّصلو.
+    """
+    state = sheets_sync_state()
+    if state["sync"] is not None or time.time() - state["at"] < SYNC_RETRY_SECS:
+        return state["sync"]
+    if not state["lock"].acquire(blocking=False):  # جلسة أخرى تجرّب توّا
+        return state["sync"]
     try:
-        ws = sh.worksheet(title)
-    except gspread.WorksheetNotFound:
-        ws = sh.add_worksheet(title=title, rows="2000", cols=str(max(len(columns), 8)))
-        ws.update("1:1", [columns])
-        return ws
-    header = ws.row_values(1)
-    if not header or header[:len(columns)] != columns:
-        ws.update("1:1", [columns])
-    return ws
-
-# ============ تحميل كل أوراق الموظفين (باستعمال أسماء الأعمدة) ============
-@st.cache_data(ttl=600)
+        state["at"] = time.time()
+        local = get_sqlite_storage()
+        sync = SheetsSync(local, get_sheets_remote(), get_sheet_store())
+        if not local.list_sheets():
+            sync.pull()  # أول تشغيل: نعبّيو SQLite من Google Sheets
+        threading.Thread(target=sync.run_forever, daemon=True).start()
+        state["sync"] = sync
+    except Exception:
+        pass
+    finally:
+        state["lock"].release()
+    return state["sync"]
+
+@st.cache_resource
+def get_sheets_remote() -> SheetsStorage:
+    """SheetsStorage مشترك (بلا طابور) للـ threads متاع الخلفية + كاش الـ worksheets."""
+    return SheetsStorage(get_spreadsheet())
+
+@st.cache_resource
+def get_sheets_writer() -> SheetsWriter:
+    return SheetsWriter(get_sheets_remote(), get_sheet_store())
+
+def get_storage():
+    """SqliteStorage (مع مزامنة في الخلفية) ولا SheetsStorage حسب STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "sqlite":
+        get_sheets_sync()
+        return get_sqlite_storage()
+    if "sheets_storage" not in st.session_state:
+        try:
+            remote = get_sheets_remote()
+        except gse.APIError:
+            st.error("تعذر فتح Google Sheet (ربما الكوتا تعدّت).")
+            raise
+        st.session_state["sheets_storage"] = SheetsStorage(
+            remote.sh, writer=get_sheets_writer(), shared=remote
+        )
+    return st.session_state["sheets_storage"]
+
+def render_write_status():
+    """حالة الكتابات اللي بعثتها الجلسة هذي للطابور."""
+    storage = get_storage()
+    if getattr(storage, "writer", None) is None or not storage.pending:
+        return
+    status = storage.writer.take_status(storage.pending)
+    queued = [w for w, state in status.items() if state == "queued"]
+    failed = [state for state in status.values() if state.startswith("failed")]
+    storage.pending = queued
+    if queued:
+        st.caption(f"⏳ {len(queued)} تعديل(ات) في الطريق لـ Google Sheets…")
+    for msg in failed:
+        st.error(f"❌ ما تسجّلش تعديل في Google Sheets ({msg}) — البيانات تعاودت تتقرا.")
+
+def storage_written():
+    """بعد كل كتابة: نفيّقو المزامنة (كان SQLite)."""
+    if STORAGE_BACKEND == "sqlite":
+        sync = get_sheets_sync()
+        if sync is not None:
+            sync.notify()
+
 def load_all_data():
-    sh = get_spreadsheet()
-    all_dfs, all_emps = [], []
-
-    for ws in sh.worksheets():
-        title = ws.title.strip()
-
-        # نستثني أوراق المداخيل والأنظمة الداخلية
-        if title.endswith("_PAIEMENTS"):
-            continue
-        if title.startswith("_"):
-            continue
-        if title in (REASSIGN_LOG_SHEET,):
-            continue
-
-        all_emps.append(title)
-
-        rows = ws.get_all_values()
-        if not rows:
-            # لو الورقة فارغة، نعمل header بالصيغة الجديدة
-            ws.update("1:1", [EXPECTED_HEADERS])
-            rows = ws.get_all_values()
-
-        header_row = rows[0] if rows else []
-        data_rows = rows[1:] if len(rows) > 1 else []
-
-        # مابينغ من اسم العمود → index
-        header_map = {str(name).strip(): idx for idx, name in enumerate(header_row)}
-
-        fixed = []
-        for r in data_rows:
-            r = list(r or [])
-            new_row = []
-            # نركّب صف جديد حسب EXPECTED_HEADERS
-            for col_name in EXPECTED_HEADERS:
-                idx = header_map.get(col_name)
-                if idx is not None and idx < len(r):
-                    new_row.append(r[idx])
-                else:
-                    new_row.append("")  # لو الكولون موش موجود في النسخة القديمة
-            fixed.append(new_row)
+    with timed("load", "load_all_data"):
+        return get_sheet_store().load(get_storage())
+
+def load_employee_data(employee: str):
+    """(ورقة الموظّف كاملة، أسماء الأوراق) + phone_index عام، بلا ما نحمّلو أوراق الآخرين."""
+    with timed("load", "load_employee_data"):
+        return get_sheet_store().load_employee(get_storage(), employee)
+
+@st.cache_resource
+def startup_stats() -> dict:
+    """cold start متاع العملية: يتعمّر مرّة وحدة في آخر أوّل render (mark_first_render)."""
+    t0 = process_started_at()
+    return {
+        "t0": t0,
+        "started_at": datetime.fromtimestamp(t0) if t0 else datetime.now(),
+        "first_render_ms": None,
+    }
 
-        df = pd.DataFrame(fixed, columns=EXPECTED_HEADERS)
-        df["__sheet_name"] = title
-        all_dfs.append(df)
+def mark_first_render():
+    boot = startup_stats()
+    if boot["t0"] is None or boot["first_render_ms"] is not None:
+        return
+    boot["first_render_ms"] = round((time.time() - boot["t0"]) * 1000, 1)
+    if PROFILER is not None:
+        PROFILER.record("startup", "first_render", boot["first_render_ms"])
 
-    big = (
-        pd.concat(all_dfs, ignore_index=True)
-        if all_dfs
-        else pd.DataFrame(columns=EXPECTED_HEADERS + ["__sheet_name"])
-    )
-    return big, all_emps
+startup_stats()
 
-df_all, all_employes = load_all_data()
+# الـ sidebar يحتاج كان أسماء الأوراق؛ الداتا تتحمّل في الأقسام كي تبان
+all_employes = get_sheet_store().employee_titles(get_storage())
 
 # ============ Sidebar ============
-try:
-    st.sidebar.image(Image.open("logo.png"), use_container_width=True)
-except Exception:
-    pass
+@st.cache_resource
+def logo_bytes() -> bytes | None:
+    """logo.png يتقرا مرّة للعملية؛ st.image ياخذ الـ bytes مباشرة بلا PIL."""
+    try:
+        with open("logo.png", "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+if logo_bytes():
+    st.sidebar.image(logo_bytes(), use_container_width=True)
 
 tab_choice = st.sidebar.radio("📑 اختر تبويب:", ["CRM", "أرشيف"], index=0)
 role = st.sidebar.radio("الدور", ["موظف", "أدمن"], horizontal=True)
@@ -327,6 +452,7 @@ def emp_lock_ui(emp_name: str, ns: str = ""):
             if c2.button("قفل الآن", key=f"btn_close::{ns_prefix}"):
                 st.session_state[f"emp_ok::{emp_name}"] = False
                 st.session_state[f"emp_ok_at::{emp_name}"] = None
+                st.rerun()
         else:
             pwd_try = st.text_input(
                 "أدخل كلمة السرّ", type="password", key=f"pwd::{ns_prefix}"
@@ -335,250 +461,165 @@ def emp_lock_ui(emp_name: str, ns: str = ""):
                 if pwd_try == emp_pwd_for(emp_name):
                     st.session_state[f"emp_ok::{emp_name}"] = True
                     st.session_state[f"emp_ok_at::{emp_name}"] = datetime.now()
-                    st.success("تم الفتح لمدة 15 دقيقة.")
+                    st.rerun()  # rerun كامل: الإحصائيات والبحث يبانو كان بعد الفتح
                 else:
                     st.error("كلمة سرّ غير صحيحة.")
 
-# ============ مشتقات عامة ============
-df_all = df_all.copy()
-if not df_all.empty:
-    df_all["DateAjout_dt"] = pd.to_datetime(
-        df_all["Date ajout"], dayfirst=True, errors="coerce"
-    )
-    df_all["DateSuivi_dt"] = pd.to_datetime(
-        df_all["Date de suivi"], dayfirst=True, errors="coerce"
-    )
-    df_all["Mois"] = df_all["DateAjout_dt"].dt.strftime("%m-%Y")
+# ============ الأقسام (كل قسم fragment يتحسب كان وقت يبان) ============
+# st.fragment: تفاعل الـ widgets داخل قسم يعاود يشغّل القسم هذاكا برك
+section = (
+    getattr(st, "fragment", None)
+    or getattr(st, "experimental_fragment", None)
+    or (lambda fn: fn)
+)
+# كل قسم يعاود load_all_data() (من الكاش) باش rerun متاع fragment وحدو
+# يشوف الـ patches اللي صارت بعد آخر rerun كامل
 
-    today = datetime.now().date()
-    base_alert = df_all["Alerte"].fillna("").astype(str).str.strip()
-    dsv_date = df_all["DateSuivi_dt"].dt.date
-    due_today = dsv_date.eq(today).fillna(False)
-    overdue = dsv_date.lt(today).fillna(False)
+# ============ Dashboard سريع ============
+@section
+@profiled("dashboard")
+def render_dashboard(employee: str | None = None):
+    """نفس الأرقام العامة للكل؛ employee: من الـ cubes المشتركة (global_cube) بلا load_all_data."""
+    st.subheader("لوحة إحصائيات سريعة")
+    if employee is None:
+        load_all_data()
+        stats_cube = get_sheet_store().stats_cube()
+    else:
+        stats_cube = get_sheet_store().global_cube(get_storage())
+    if stats_cube.empty:
+        st.info("ما فماش داتا للعرض.")
+    else:
+        today = pd.Timestamp(datetime.now().date())
+        cube_today = stats_cube[stats_cube["day"] == today]
 
-    df_all["Alerte_view"] = base_alert
-    df_all.loc[base_alert.eq("") & overdue, "Alerte_view"] = "⚠️ متابعة متأخرة"
-    df_all.loc[base_alert.eq("") & due_today, "Alerte_view"] = "⏰ متابعة اليوم"
+        total_clients = int(stats_cube["Clients"].sum())
+        added_today = int(cube_today["Clients"].sum())
+        registered_today = int(cube_today["Inscrits_any"].sum())
+        alerts_now = int(stats_cube["Alerts"].sum())
+        registered_total = int(stats_cube["Inscrits"].sum())
+        rate = round((registered_total / total_clients) * 100, 2) if total_clients else 0.0
 
-    df_all["Téléphone_norm"] = df_all["Téléphone"].apply(normalize_tn_phone)
-    ALL_PHONES = set(df_all["Téléphone_norm"].dropna().astype(str))
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c1.metric("👥 إجمالي العملاء", f"{total_clients}")
+        c2.metric("🆕 المضافون اليوم", f"{added_today}")
+        c3.metric("✅ المسجّلون اليوم", f"{registered_today}")
+        c4.metric("🚨 التنبيهات الحالية", f"{alerts_now}")
+        c5.metric("📈 نسبة التسجيل الإجمالية", f"{rate}%")
 
-    df_all["Inscription_norm"] = (
-        df_all["Inscription"].fillna("").astype(str).str.strip().str.lower()
-    )
-    inscrit_mask = df_all["Inscription_norm"].isin(["oui", "inscrit"])
-    df_all.loc[inscrit_mask, "Date de suivi"] = ""
-    df_all.loc[inscrit_mask, "Alerte_view"] = ""
-else:
-    df_all["Alerte_view"] = ""
-    df_all["Mois"] = ""
-    df_all["Téléphone_norm"] = ""
-    ALL_PHONES = set()
-
-# ============ Dashboard سريع ============
-st.subheader("لوحة إحصائيات سريعة")
-df_dash = df_all.copy()
-if df_dash.empty:
-    st.info("ما فماش داتا للعرض.")
-else:
-    df_dash["DateAjout_dt"] = pd.to_datetime(
-        df_dash["Date ajout"], dayfirst=True, errors="coerce"
-    )
-    df_dash["DateSuivi_dt"] = pd.to_datetime(
-        df_dash["Date de suivi"], dayfirst=True, errors="coerce"
-    )
-    today = datetime.now().date()
-    df_dash["Inscription_norm"] = (
-        df_dash["Inscription"].fillna("").astype(str).str.strip().str.lower()
-    )
-    df_dash["Alerte_norm"] = (
-        df_dash["Alerte_view"].fillna("").astype(str).str.strip()
-    )
-
-    added_today_mask = df_dash["DateAjout_dt"].dt.date.eq(today)
-    registered_today_mask = df_dash["Inscription_norm"].isin(
-        ["oui", "inscrit"]
-    ) & added_today_mask
-    alert_now_mask = df_dash["Alerte_norm"].ne("")
-
-    total_clients = int(len(df_dash))
-    added_today = int(added_today_mask.sum())
-    registered_today = int(registered_today_mask.sum())
-    alerts_now = int(alert_now_mask.sum())
-    registered_total = int((df_dash["Inscription_norm"] == "oui").sum())
-    rate = round((registered_total / total_clients) * 100, 2) if total_clients else 0.0
-
-    c1, c2, c3, c4, c5 = st.columns(5)
-    c1.metric("👥 إجمالي العملاء", f"{total_clients}")
-    c2.metric("🆕 المضافون اليوم", f"{added_today}")
-    c3.metric("✅ المسجّلون اليوم", f"{registered_today}")
-    c4.metric("🚨 التنبيهات الحالية", f"{alerts_now}")
-    c5.metric("📈 نسبة التسجيل الإجمالية", f"{rate}%")
+    render_monthly(stats_cube)
 
 # ============ إحصائيات شهرية ============
-st.markdown("---")
-st.subheader("📅 إحصائيات شهرية (العملاء)")
-if not df_all.empty and "DateAjout_dt" in df_all.columns:
-    df_all["MonthStr"] = df_all["DateAjout_dt"].dt.strftime("%Y-%m")
-    months_avail = sorted(df_all["MonthStr"].dropna().unique(), reverse=True)
-    month_pick = (
-        st.selectbox("اختر شهر", months_avail, index=0) if months_avail else None
-    )
-    if month_pick:
-        df_month = df_all[df_all["MonthStr"] == month_pick].copy()
-
-        total_clients_m = len(df_month)
-        total_inscrits_m = int((df_month["Inscription_norm"] == "oui").sum())
-        alerts_m = int(
-            df_month["Alerte_view"]
-            .fillna("")
-            .astype(str)
-            .str.strip()
-            .ne("")
-            .sum()
-        )
-        rate_m = (
-            round((total_inscrits_m / total_clients_m) * 100, 2)
-            if total_clients_m
-            else 0.0
+@profiled("monthly")
+def render_monthly(stats_cube: pd.DataFrame):
+    st.markdown("---")
+    st.subheader("📅 إحصائيات شهرية (العملاء)")
+    if not stats_cube.empty:
+        months_avail = sorted(stats_cube["MonthStr"].dropna().unique(), reverse=True)
+        month_pick = (
+            st.selectbox("اختر شهر", months_avail, index=0) if months_avail else None
         )
-
-        c1, c2, c3, c4 = st.columns(4)
-        c1.metric("👥 عملاء هذا الشهر", f"{total_clients_m}")
-        c2.metric("✅ مسجّلون", f"{total_inscrits_m}")
-        c3.metric("🚨 تنبيهات", f"{alerts_m}")
-        c4.metric("📈 نسبة التسجيل", f"{rate_m}%")
-
-        st.markdown("#### 👨‍💼 حسب الموظّف")
-        grp_emp = (
-            df_month.groupby("__sheet_name", dropna=False)
-            .agg(
-                Clients=("Nom & Prénom", "count"),
-                Inscrits=(
-                    "Inscription_norm",
-                    lambda x: (x == "oui").sum(),
-                ),
-                Alerts=(
-                    "Alerte_view",
-                    lambda x: (
-                        x.fillna("").astype(str).str.strip() != ""
-                    ).sum(),
-                ),
+        if month_pick:
+            cube_month = stats_cube[stats_cube["MonthStr"] == month_pick]
+
+            total_clients_m = int(cube_month["Clients"].sum())
+            total_inscrits_m = int(cube_month["Inscrits"].sum())
+            alerts_m = int(cube_month["Alerts"].sum())
+            rate_m = (
+                round((total_inscrits_m / total_clients_m) * 100, 2)
+                if total_clients_m
+                else 0.0
             )
-            .reset_index()
-            .rename(columns={"__sheet_name": "الموظف"})
-        )
 
-        _today = datetime.now().date()
-        df_all_dates = df_all.copy()
-        df_all_dates["DateAjout_dt"] = pd.to_datetime(
-            df_all_dates["Date ajout"], dayfirst=True, errors="coerce"
-        )
-
-        daily_clients_map = (
-            df_all_dates[df_all_dates["DateAjout_dt"].dt.date == _today]
-            .groupby("__sheet_name")["Nom & Prénom"]
-            .count()
-        )
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("👥 عملاء هذا الشهر", f"{total_clients_m}")
+            c2.metric("✅ مسجّلون", f"{total_inscrits_m}")
+            c3.metric("🚨 تنبيهات", f"{alerts_m}")
+            c4.metric("📈 نسبة التسجيل", f"{rate_m}%")
+
+            st.markdown("#### 👨‍💼 حسب الموظّف")
+            grp_emp = cube_month.groupby("__sheet_name", sort=False, observed=True)[
+                ["Clients", "Inscrits", "Alerts"]
+            ].sum()
+
+            _today = pd.Timestamp(datetime.now().date())
+            daily = (
+                stats_cube[stats_cube["day"] == _today]
+                .groupby("__sheet_name", sort=False, observed=True)[["Clients", "Inscrits_any"]]
+                .sum()
+            )
+            grp_emp["Clients اليوم"] = (
+                daily["Clients"].reindex(grp_emp.index, fill_value=0).astype(int)
+            )
+            grp_emp["Inscrits اليوم"] = (
+                daily["Inscrits_any"].reindex(grp_emp.index, fill_value=0).astype(int)
+            )
 
-        daily_inscrits_map = (
-            df_all_dates[
-                (df_all_dates["DateAjout_dt"].dt.date == _today)
-                & (
-                    df_all_dates["Inscription"]
-                    .fillna("")
-                    .astype(str)
-                    .str.strip()
-                    .str.lower()
-                    .isin(["oui", "inscrit"])
-                )
+            grp_emp["% تسجيل"] = (
+                (grp_emp["Inscrits"] / grp_emp["Clients"])
+                .replace([float("inf"), float("nan")], 0)
+                .mul(100)
+                .round(2)
+            )
+            grp_emp = grp_emp.reset_index().rename(columns={"__sheet_name": "الموظف"})
+
+            cols_order = [
+                "الموظف",
+                "Clients",
+                "Clients اليوم",
+                "Inscrits اليوم",
+                "Inscrits",
+                "% تسجيل",
+                "Alerts",
             ]
-            .groupby("__sheet_name")["Nom & Prénom"]
-            .count()
-        )
-
-        grp_emp = grp_emp.merge(
-            daily_clients_map.rename("Clients اليوم")
-            .reset_index()
-            .rename(columns={"__sheet_name": "الموظف"}),
-            on="الموظف",
-            how="left",
-        )
-        grp_emp = grp_emp.merge(
-            daily_inscrits_map.rename("Inscrits اليوم")
-            .reset_index()
-            .rename(columns={"__sheet_name": "الموظف"}),
-            on="الموظف",
-            how="left",
-        )
-
-        grp_emp["Clients اليوم"] = grp_emp["Clients اليوم"].fillna(0).astype(int)
-        grp_emp["Inscrits اليوم"] = grp_emp["Inscrits اليوم"].fillna(0).astype(int)
+            grp_emp = grp_emp[[c for c in cols_order if c in grp_emp.columns]]
 
-        grp_emp["% تسجيل"] = (
-            (grp_emp["Inscrits"] / grp_emp["Clients"])
-            .replace([float("inf"), float("nan")], 0)
-            .mul(100)
-            .round(2)
-        )
-
-        cols_order = [
-            "الموظف",
-            "Clients",
-            "Clients اليوم",
-            "Inscrits اليوم",
-            "Inscrits",
-            "% تسجيل",
-            "Alerts",
-        ]
-        grp_emp = grp_emp[[c for c in cols_order if c in grp_emp.columns]]
-
-        st.dataframe(
-            grp_emp.sort_values(["Inscrits", "Clients"], ascending=False),
-            use_container_width=True,
-        )
+            st.dataframe(
+                grp_emp.sort_values(["Inscrits", "Clients"], ascending=False),
+                use_container_width=True,
+            )
 
 # ============ بحث عام برقم الهاتف ============
-st.subheader("🔎 بحث عام برقم الهاتف")
-global_phone = st.text_input("اكتب رقم الهاتف (8 أرقام محلية أو 216XXXXXXXX)")
-if global_phone.strip():
-    q = normalize_tn_phone(global_phone)
-    sd = df_all.copy()
-    sd["Téléphone_norm"] = sd["Téléphone"].apply(normalize_tn_phone)
-    sd["Alerte"] = sd.get("Alerte_view", "")
-    sd = sd[sd["Téléphone_norm"] == q]
-    if sd.empty:
-        st.info("❕ ما لقيتش عميل بهذا الرقم.")
+@section
+@profiled("search")
+def render_global_search(employee: str | None = None):
+    """employee: phone_index (عمود الهاتف من كل ورقة) + قراية الصف، بلا load_all_data."""
+    if employee is None:
+        load_all_data()
     else:
-        disp = [c for c in EXPECTED_HEADERS if c in sd.columns]
-        st.dataframe(
-            sd[disp]
-            .style.apply(highlight_inscrit_row, axis=1)
-            .applymap(mark_alert_cell, subset=["Alerte"]),
-            use_container_width=True,
-        )
-        st.markdown("---")
+        load_employee_data(employee)
+    st.subheader("🔎 بحث عام برقم الهاتف")
+    global_phone = st.text_input("اكتب رقم الهاتف (8 أرقام محلية أو 216XXXXXXXX)")
+    if global_phone.strip():
+        q = normalize_tn_phone(global_phone)
+        sd = search_phone(get_storage(), q, get_sheet_store())
+        if sd.empty:
+            st.info("❕ ما لقيتش عميل بهذا الرقم.")
+        else:
+            render_table(sd, key="global_search")
+            st.markdown("---")
 
 # ============ تبويب CRM للموظّف ============
-if role == "موظف" and employee:
+@section
+@profiled("employee_crm")
+def render_employee_crm(employee: str):
     emp_lock_ui(employee, ns="crm")
     if not emp_unlocked(employee):
         st.info("🔒 أدخل كلمة سرّ الموظّف لفتح الورقة.")
-        st.stop()
+        return
+    df_emp_raw, all_employes = load_employee_data(employee)
+    # فهرس الهواتف متاع الكاش (dict) يكفي للـ duplicate check، بلا set جديد في كل rerun
+    ALL_PHONES = get_sheet_store().phone_index
 
     st.subheader(f"📁 لوحة {employee}")
-    df_emp_raw = df_all[df_all["__sheet_name"] == employee].copy()
+    render_write_status()
     if df_emp_raw.empty:
         st.warning("⚠️ لا يوجد أي عملاء بعد.")
-        st.stop()
+        return
 
     # ===== 🎂 تنبيهات أعياد الميلاد =====
     try:
         if "Date de naissance" in df_emp_raw.columns:
-            df_birth = df_emp_raw.copy()
-            df_birth["Birth_dt"] = pd.to_datetime(
-                df_birth["Date de naissance"], dayfirst=True, errors="coerce"
-            )
+            df_birth = df_emp_raw
             today = datetime.now().date()
             bday_mask = (
                 df_birth["Birth_dt"].dt.month.eq(today.month)
@@ -590,7 +631,7 @@ if role == "موظف" and employee:
                 st.markdown("### 🎂 تنبيهات أعياد الميلاد اليوم")
                 for _, row in bday_df.iterrows():
                     name = str(row.get("Nom & Prénom", "")).strip()
-                    phone_norm = normalize_tn_phone(row.get("Téléphone", ""))
+                    phone_norm = row.get("Téléphone_norm", "")
                     phone_display = format_display_phone(phone_norm)
 
                     st.success(f"اليوم عيد ميلاد: **{name}** — {phone_display}")
@@ -609,16 +650,11 @@ if role == "موظف" and employee:
         st.warning(f"تعذّر حساب أعياد الميلاد: {e}")
 
     # نسخة للعمل على الفلترة
-    df_emp = df_emp_raw.copy()
-    df_emp["DateAjout_dt"] = pd.to_datetime(
-        df_emp["Date ajout"], dayfirst=True, errors="coerce"
-    )
-    df_emp = df_emp.dropna(subset=["DateAjout_dt"])
-    df_emp["Mois"] = df_emp["DateAjout_dt"].dt.strftime("%m-%Y")
+    df_emp = df_emp_raw.dropna(subset=["DateAjout_dt"])
     month_options = sorted(df_emp["Mois"].dropna().unique(), reverse=True)
     month_filter = st.selectbox("🗓️ اختر شهر الإضافة", month_options)
 
-    filtered_df = df_emp[df_emp["Mois"] == month_filter].copy()
+    filtered_df = df_emp[df_emp["Mois"] == month_filter]
 
     # ===== فلترة بالتكوين =====
     st.markdown("#### 🔎 فلترة حسب التكوين")
@@ -629,7 +665,6 @@ if role == "موظف" and employee:
             [
                 f
                 for f in filtered_df["Formation"]
-                .fillna("")
                 .astype(str)
                 .str.strip()
                 .unique()
@@ -645,32 +680,15 @@ if role == "موظف" and employee:
             ]
 
     # ===== عرض قائمة العملاء =====
-    def render_table(df_disp: pd.DataFrame):
-        if df_disp.empty:
-            st.info("لا توجد بيانات.")
-            return
-        _df = df_disp.copy()
-        _df["Alerte"] = _df.get("Alerte_view", "")
-        styled = (
-            _df[[c for c in EXPECTED_HEADERS if c in _df.columns]]
-            .style.apply(highlight_inscrit_row, axis=1)
-            .applymap(mark_alert_cell, subset=["Alerte"])
-            .applymap(color_tag, subset=["Tag"])
-        )
-        st.dataframe(styled, use_container_width=True)
-
     st.markdown("### 📋 قائمة العملاء")
-    render_table(filtered_df)
+    render_table(filtered_df, key=f"crm_list::{employee}")
 
     # --- عرض العملاء الذين لديهم تنبيهات ---
     if (not filtered_df.empty) and st.checkbox("🔴 عرض العملاء الذين لديهم تنبيهات"):
-        _df_alerts = filtered_df.copy()
-        _df_alerts["Alerte"] = _df_alerts.get("Alerte_view", "")
-        alerts_df = _df_alerts[
-            _df_alerts["Alerte"].fillna("").astype(str).str.strip() != ""
-        ]
+        # render_table يعرض Alerte من Alerte_view، يكفي mask
+        alerts_df = filtered_df[filtered_df["Alerte_view"].astype(str).str.strip() != ""]
         st.markdown("### 🚨 عملاء مع تنبيهات")
-        render_table(alerts_df)
+        render_table(alerts_df, key=f"crm_alerts::{employee}")
 
     # ================== ➕ أضف عميل جديد (للموظّف) ==================
     st.markdown("### ➕ أضف عميل جديد")
@@ -740,36 +758,24 @@ if role == "موظف" and employee:
                     employee,
                     "",
                 ]
-                sh = get_spreadsheet()
-                ws_emp = sh.worksheet(employee)
-                header = ws_emp.row_values(1) or []
-                if not header or header[: len(EXPECTED_HEADERS)] != EXPECTED_HEADERS:
-                    ws_emp.update("1:1", [EXPECTED_HEADERS])
-                ws_emp.append_row(row_to_append)
+                storage = get_storage()
+                storage.ensure_sheet(employee, EXPECTED_HEADERS)
+                new_row = storage.append_row(employee, row_to_append)
+                storage_written()
                 st.success("✅ تم إضافة العميل بنجاح.")
-                st.cache_data.clear()
+                get_sheet_store().apply_append(employee, row_to_append, new_row)
                 st.rerun()
         except Exception as e:
             st.error(f"❌ خطأ أثناء الإضافة: {e}")
 
     # ================== ✏️ تعديل عميل ==================
     st.markdown("### ✏️ تعديل بيانات عميل")
-    df_emp_edit = df_emp_raw.copy()
-    df_emp_edit["Téléphone_norm"] = df_emp_edit["Téléphone"].apply(normalize_tn_phone)
-    options = {
-        f"[{i}] {r['Nom & Prénom']} — {format_display_phone(r['Téléphone_norm'])}": r[
-            "Téléphone_norm"
-        ]
-        for i, r in df_emp_edit.iterrows()
-        if str(r.get("Téléphone", "")).strip() != ""
-    }
+    chosen_phone = client_picker(
+        "اختر العميل (بالاسم/الهاتف)", f"edit_pick::{employee}", df_emp_raw, title=employee
+    )
 
-    if options:
-        chosen_key = st.selectbox(
-            "اختر العميل (بالاسم/الهاتف)", list(options.keys())
-        )
-        chosen_phone = options[chosen_key]
-        cur_row = df_emp_edit[df_emp_edit["Téléphone_norm"] == chosen_phone].iloc[0]
+    if chosen_phone:
+        cur_row = df_emp_raw[df_emp_raw["Téléphone_norm"] == chosen_phone].iloc[0]
 
         with st.form(f"edit_client_form::{employee}"):
             col1, col2 = st.columns(2)
@@ -784,16 +790,10 @@ if role == "موظف" and employee:
                     "📚 التكوين", value=str(cur_row["Formation"])
                 )
             with col2:
-                raw_birth = str(cur_row.get("Date de naissance", "")).strip()
-                if raw_birth:
-                    dt_birth = pd.to_datetime(
-                        raw_birth, dayfirst=True, errors="coerce"
-                    )
-                    default_birth = (
-                        dt_birth.date() if pd.notna(dt_birth) else date.today()
-                    )
-                else:
-                    default_birth = date.today()
+                birth_dt = cur_row.get("Birth_dt")
+                default_birth = (
+                    birth_dt.date() if pd.notna(birth_dt) else date.today()
+                )
 
                 new_birth = st.date_input(
                     "🎂 تاريخ الميلاد", value=default_birth
@@ -801,22 +801,13 @@ if role == "موظف" and employee:
 
                 new_ajout = st.date_input(
                     "🕓 تاريخ الإضافة",
-                    value=pd.to_datetime(
-                        cur_row["Date ajout"], dayfirst=True, errors="coerce"
-                    ).date(),
+                    value=cur_row["DateAjout_dt"].date(),
                 )
 
+                suivi_dt = cur_row["DateSuivi_dt"]
                 new_suivi = st.date_input(
                     "📆 تاريخ المتابعة",
-                    value=(
-                        pd.to_datetime(
-                            cur_row["Date de suivi"],
-                            dayfirst=True,
-                            errors="coerce",
-                        ).date()
-                        if str(cur_row["Date de suivi"]).strip()
-                        else date.today()
-                    ),
+                    value=(suivi_dt.date() if pd.notna(suivi_dt) else date.today()),
                 )
 
                 new_insc = st.selectbox(
@@ -840,131 +831,96 @@ if role == "موظف" and employee:
 
         if submitted:
             try:
-                ws = get_spreadsheet().worksheet(employee)
-                values = ws.get_all_values()
-                header = values[0] if values else []
-                tel_idx = header.index("Téléphone")
-                row_idx = None
-                for i, r in enumerate(values[1:], start=2):
-                    if len(r) > tel_idx and normalize_tn_phone(r[tel_idx]) == chosen_phone:
-                        row_idx = i
-                        break
-                if not row_idx:
-                    st.error("❌ تعذّر إيجاد الصف.")
-                    st.stop()
-
-                col_map = {
-                    h: (EXPECTED_HEADERS.index(h) + 1)
-                    for h in [
-                        "Nom & Prénom",
-                        "Téléphone",
-                        "Date de naissance",
-                        "Formation",
-                        "Date ajout",
-                        "Date de suivi",
-                        "Inscription",
-                        "Remarque",
-                    ]
-                }
-
-                new_phone_norm = normalize_tn_phone(new_phone_raw)
-                if not new_name.strip():
-                    st.error("❌ الاسم مطلوب.")
-                    st.stop()
-                if not new_phone_norm.strip():
-                    st.error("❌ الهاتف مطلوب.")
-                    st.stop()
+                with count_api_calls() as api_calls:
+                    storage = get_storage()
+                    row_idx, _ = find_client_row(storage, employee, chosen_phone, get_sheet_store())
+                    if not row_idx:
+                        st.error("❌ تعذّر إيجاد الصف.")
+                        st.stop()
 
-                phones_except = set(df_all["Téléphone_norm"]) - {
-                    normalize_tn_phone(chosen_phone)
-                }
-                if new_phone_norm in phones_except:
-                    st.error("⚠️ الرقم موجود مسبقًا.")
-                    st.stop()
+                    new_phone_norm = normalize_tn_phone(new_phone_raw)
+                    if not new_name.strip():
+                        st.error("❌ الاسم مطلوب.")
+                        st.stop()
+                    if not new_phone_norm.strip():
+                        st.error("❌ الهاتف مطلوب.")
+                        st.stop()
 
-                ws.update_cell(row_idx, col_map["Nom & Prénom"], new_name.strip())
-                ws.update_cell(row_idx, col_map["Téléphone"], new_phone_norm)
-                ws.update_cell(
-                    row_idx,
-                    col_map["Date de naissance"],
-                    fmt_date(new_birth),
-                )
-                ws.update_cell(
-                    row_idx, col_map["Formation"], new_formation.strip()
-                )
-                ws.update_cell(row_idx, col_map["Date ajout"], fmt_date(new_ajout))
-                ws.update_cell(row_idx, col_map["Date de suivi"], fmt_date(new_suivi))
-                ws.update_cell(
-                    row_idx,
-                    col_map["Inscription"],
-                    "Oui" if new_insc == "Inscrit" else "Pas encore",
-                )
+                    if new_phone_norm != chosen_phone and new_phone_norm in ALL_PHONES:
+                        st.error("⚠️ الرقم موجود مسبقًا.")
+                        st.stop()
 
-                if extra_note.strip():
-                    old_rem = (
-                        ws.cell(row_idx, col_map["Remarque"]).value or ""
+                    updates = {
+                        "Nom & Prénom": new_name.strip(),
+                        "Téléphone": new_phone_norm,
+                        "Date de naissance": fmt_date(new_birth),
+                        "Formation": new_formation.strip(),
+                        "Date ajout": fmt_date(new_ajout),
+                        "Date de suivi": fmt_date(new_suivi),
+                        "Inscription": "Oui" if new_insc == "Inscrit" else "Pas encore",
+                    }
+                    if extra_note.strip():
+                        # الملاحظة القديمة من الكاش بلا ws.cell
+                        old_rem = str(cur_row.get("Remarque", "") or "")
+                        stamp = datetime.now().strftime("%d/%m/%Y %H:%M")
+                        updates["Remarque"] = (
+                            old_rem + "\n" if old_rem else ""
+                        ) + f"[{stamp}] {extra_note.strip()}"
+
+                    # طلب واحد لكل خانات الصف
+                    storage.update_cells(
+                        employee,
+                        row_idx,
+                        {EXPECTED_HEADERS.index(h) + 1: v for h, v in updates.items()},
+                    )
+                    storage_written()
+
+                    st.success("✅ تم حفظ التعديلات")
+                    # queued:update_cells = كتابة وحدة في الطابور → batch_update واحد
+                    # (ينجم يتجمّع مع كتابات أخرى في نفس الدفعة)
+                    st.caption(
+                        "🔢 نداءات Google Sheets لهذا الحفظ: "
+                        + ", ".join(f"{k}={v}" for k, v in api_calls.items())
+                    )
+                    get_sheet_store().apply_update(
+                        employee, chosen_phone, updates, sheet_row=row_idx
                     )
-                    stamp = datetime.now().strftime("%d/%m/%Y %H:%M")
-                    appended = (
-                        old_rem + "\n" if old_rem else ""
-                    ) + f"[{stamp}] {extra_note.strip()}"
-                    ws.update_cell(row_idx, col_map["Remarque"], appended)
-
-                st.success("✅ تم حفظ التعديلات")
-                st.cache_data.clear()
             except Exception as e:
                 st.error(f"❌ خطأ: {e}")
 
     # ================== 🎨 Tag لون ==================
     st.markdown("### 🎨 Tag لون")
     scope_df = filtered_df if not filtered_df.empty else df_emp_raw
-    scope_df = scope_df.copy()
-    scope_df["Téléphone_norm"] = scope_df["Téléphone"].apply(normalize_tn_phone)
-    tel_key2 = st.selectbox(
-        "اختر العميل للتلوين",
-        [
-            f"{r['Nom & Prénom']} — {format_display_phone(normalize_tn_phone(r['Téléphone']))}"
-            for _, r in scope_df.iterrows()
-        ],
-        key="tag_select",
+    tel_color = client_picker(
+        "اختر العميل للتلوين", "tag_select", scope_df, title=employee
     )
-    tel_color = normalize_tn_phone(tel_key2.split("—")[-1])
     hex_color = st.color_picker(
         "اللون", value=st.session_state.get("last_color", "#00AA88")
     )
-    if st.button("🖌️ تلوين"):
+    if st.button("🖌️ تلوين") and tel_color:
         try:
-            ws = get_spreadsheet().worksheet(employee)
-            values = ws.get_all_values()
-            header = values[0] if values else []
-            tel_idx = header.index("Téléphone")
-            row_idx = None
-            for i, r in enumerate(values[1:], start=2):
-                if len(r) > tel_idx and normalize_tn_phone(r[tel_idx]) == tel_color:
-                    row_idx = i
-                    break
+            storage = get_storage()
+            row_idx, _ = find_client_row(storage, employee, tel_color, get_sheet_store())
             if not row_idx:
                 st.error("❌ لم يتم إيجاد العميل.")
             else:
                 st.session_state["last_color"] = hex_color
                 color_col = EXPECTED_HEADERS.index("Tag") + 1
-                ws.update_cell(row_idx, color_col, hex_color)
+                storage.update_cells(employee, row_idx, {color_col: hex_color})
+                storage_written()
                 st.success("✅ تم التلوين")
-                st.cache_data.clear()
+                get_sheet_store().apply_update(
+                    employee, tel_color, {"Tag": hex_color}, sheet_row=row_idx
+                )
         except Exception as e:
             st.error(f"❌ خطأ: {e}")
 
     # ================== واتساب مع العميل ==================
     st.markdown("### 💬 تواصل WhatsApp مع العميل")
     try:
-        scope_for_wa = (filtered_df if not filtered_df.empty else df_emp_raw).copy()
-        wa_pick = st.selectbox(
-            "اختر العميل لفتح واتساب",
-            [
-                f"{r['Nom & Prénom']} — {format_display_phone(normalize_tn_phone(r['Téléphone']))}"
-                for _, r in scope_for_wa.iterrows()
-            ],
-            key="wa_pick",
+        scope_for_wa = filtered_df if not filtered_df.empty else df_emp_raw
+        wa_phone = client_picker(
+            "اختر العميل لفتح واتساب", "wa_pick", scope_for_wa, title=employee
         )
         default_msg = (
             "سلام! معاك Mega Formation. بخصوص التكوين، نحبّوا ننسّقو معاك موعد المتابعة. 👍"
@@ -972,10 +928,8 @@ if role == "موظف" and employee:
         wa_msg = st.text_area(
             "الرسالة (WhatsApp)", value=default_msg, key="wa_msg"
         )
-        if st.button("📲 فتح واتساب"):
-            raw_tel = wa_pick.split("—")[-1]
-            tel_norm = normalize_tn_phone(raw_tel)
-            url = f"https://wa.me/{tel_norm}?text={urllib.parse.quote(wa_msg)}"
+        if st.button("📲 فتح واتساب") and wa_phone:
+            url = f"https://wa.me/{wa_phone}?text={urllib.parse.quote(wa_msg)}"
             st.markdown(f"[افتح المحادثة الآن]({url})")
             st.info("اضغط على الرابط لفتح واتساب.")
     except Exception as e:
@@ -985,34 +939,20 @@ if role == "موظف" and employee:
     st.markdown("### 📤 تقرير يومي للإدارة (WhatsApp)")
     try:
         today = datetime.now().date()
+        today_ts = pd.Timestamp(today)
 
-        df_emp_daily = df_emp_raw.copy()
-        df_emp_daily["DateAjout_dt"] = pd.to_datetime(
-            df_emp_daily["Date ajout"], dayfirst=True, errors="coerce"
-        )
-        df_emp_daily["DateSuivi_dt"] = pd.to_datetime(
-            df_emp_daily["Date de suivi"], dayfirst=True, errors="coerce"
-        )
+        df_emp_daily = df_emp_raw
 
-        # العملاء المضافين اليوم
-        today_rows = df_emp_daily[
-            df_emp_daily["DateAjout_dt"].dt.date == today
-        ].copy()
+        # العملاء المضافين اليوم (normalize بدل .dt.date: بلا objects date لكل صف)
+        today_rows = df_emp_daily[df_emp_daily["DateAjout_dt"].dt.normalize() == today_ts]
         total_today = len(today_rows)
 
         inscrits_today = int(
-            today_rows["Inscription"]
-            .fillna("")
-            .astype(str)
-            .str.strip()
-            .str.lower()
-            .isin(["oui", "inscrit"])
-            .sum()
+            today_rows["Inscription_norm"].isin(["oui", "inscrit"]).sum()
         )
 
         alerts_today = int(
             today_rows.get("Alerte_view", today_rows.get("Alerte", ""))
-            .fillna("")
             .astype(str)
             .str.strip()
             .ne("")
@@ -1020,14 +960,12 @@ if role == "موظف" and employee:
         )
 
         # العملاء اللي عندهم متابعة/تواصل اليوم
-        contacts_today = df_emp_daily[
-            df_emp_daily["DateSuivi_dt"].dt.date == today
-        ].copy()
+        contacts_today = df_emp_daily[df_emp_daily["DateSuivi_dt"].dt.normalize() == today_ts]
 
         # تفصيل حسب التكوين للعملاء المضافين اليوم
         if not today_rows.empty:
             by_form = (
-                today_rows.groupby("Formation")["Nom & Prénom"]
+                today_rows.groupby("Formation", observed=True)["Nom & Prénom"]
                 .count()
                 .reset_index()
             )
@@ -1107,139 +1045,78 @@ if role == "موظف" and employee:
     st.markdown("### 🔁 نقل عميل بين الموظفين")
     if all_employes:
         colRA, colRB = st.columns(2)
-        src_emp = colRA.selectbox("من موظّف", all_employes, key="reassign_src")
+        # الافتراضي ورقة الموظّف (محمّلة)؛ ورقة أخرى تتقرا كان كي تتختار
+        src_emp = colRA.selectbox(
+            "من موظّف",
+            all_employes,
+            index=all_employes.index(employee) if employee in all_employes else 0,
+            key="reassign_src",
+        )
         dst_emp = colRB.selectbox(
             "إلى موظّف",
             [e for e in all_employes if e != src_emp],
             key="reassign_dst",
         )
-        df_src = df_all[df_all["__sheet_name"] == src_emp].copy()
+        df_src = get_sheet_store().frame(get_storage(), src_emp)
         if df_src.empty:
             st.info("❕ لا يوجد عملاء عند هذا الموظّف.")
         else:
-            pick = st.selectbox(
-                "اختر العميل للنقل",
-                [
-                    f"{r['Nom & Prénom']} — {format_display_phone(r['Téléphone'])}"
-                    for _, r in df_src.iterrows()
-                ],
-                key="reassign_pick",
+            phone_pick = client_picker(
+                "اختر العميل للنقل", "reassign_pick", df_src, title=src_emp
             )
-            phone_pick = normalize_tn_phone(pick.split("—")[-1])
-            if st.button("🚚 نقل الآن"):
+            if st.button("🚚 نقل الآن") and phone_pick:
                 try:
-                    sh = get_spreadsheet()
-                    ws_src = sh.worksheet(src_emp)
-                    ws_dst = sh.worksheet(dst_emp)
-                    values = ws_src.get_all_values()
-                    header = values[0] if values else []
-                    tel_idx = header.index("Téléphone")
-                    row_idx = None
-                    for i, r in enumerate(values[1:], start=2):
-                        if len(r) > tel_idx and normalize_tn_phone(r[tel_idx]) == phone_pick:
-                            row_idx = i
-                            break
-                    if not row_idx:
-                        st.error("❌ لم يتم العثور على هذا العميل.")
-                        st.stop()
-                    row_values = ws_src.row_values(row_idx)
-                    if len(row_values) < len(EXPECTED_HEADERS):
-                        row_values += [""] * (
-                            len(EXPECTED_HEADERS) - len(row_values)
-                        )
-                    row_values = row_values[: len(EXPECTED_HEADERS)]
-                    row_values[EXPECTED_HEADERS.index("Employe")] = dst_emp
-                    ws_dst.append_row(row_values)
-                    ws_src.delete_rows(row_idx)
-                    wslog = ensure_ws(REASSIGN_LOG_SHEET, REASSIGN_LOG_HEADERS)
-                    wslog.append_row(
-                        [
-                            datetime.now(timezone.utc).isoformat(),
-                            employee,
-                            src_emp,
-                            dst_emp,
-                            row_values[0],
-                            normalize_tn_phone(row_values[1]),
-                        ]
-                    )
-                    st.success(
-                        f"✅ نقل ({row_values[0]}) من {src_emp} إلى {dst_emp}"
+                    moved = move_client(
+                        get_storage(), src_emp, dst_emp, phone_pick, get_sheet_store(),
+                        reassign_by=employee,
                     )
-                    st.cache_data.clear()
+                    if moved is None:
+                        st.error("❌ لم يتم العثور على هذا العميل.")
+                    else:
+                        storage_written()
+                        st.success(f"✅ نقل ({moved[0]}) من {src_emp} إلى {dst_emp}")
                 except Exception as e:
                     st.error(f"❌ خطأ أثناء النقل: {e}")
 
 # ============ تبويب الأرشيف ============
-if tab_choice == "أرشيف" and role == "موظف" and employee:
+@section
+@profiled("archive")
+def render_archive(employee: str):
     emp_lock_ui(employee, ns="archive")
     if not emp_unlocked(employee):
         st.info("🔒 أدخل كلمة سرّ الموظّف لفتح الأرشيف.")
-        st.stop()
+        return
+    df_emp_all, _ = load_employee_data(employee)
 
     st.subheader(f"🗂️ أرشيف — {employee}")
-    ARCHIVE_SHEET = f"{employee}_Archive"
-    ws_arch = ensure_ws(ARCHIVE_SHEET, EXPECTED_HEADERS)
-    vals_arch = ws_arch.get_all_values()
-    df_arch = (
-        pd.DataFrame(vals_arch[1:], columns=vals_arch[0])
-        if vals_arch and len(vals_arch) > 1
-        else pd.DataFrame(columns=EXPECTED_HEADERS)
-    )
+    render_write_status()
+    ARCHIVE_SHEET = f"{employee}{ARCHIVE_SUFFIX}"
+    storage = get_storage()
+    storage.ensure_sheet(ARCHIVE_SHEET, EXPECTED_HEADERS)  # مرّة وحدة للعملية
+    df_arch = get_sheet_store().frame(storage, ARCHIVE_SHEET)
 
     if df_arch.empty:
         st.info("لا يوجد عملاء في الأرشيف حالياً.")
     else:
-        df_arch["Téléphone_norm"] = df_arch["Téléphone"].apply(normalize_tn_phone)
-        df_arch["Alerte_view"] = df_arch.get("Alerte", "")
-        st.dataframe(
-            df_arch[[c for c in EXPECTED_HEADERS if c in df_arch.columns]]
-            .style.apply(highlight_inscrit_row, axis=1)
-            .applymap(mark_alert_cell, subset=["Alerte"]),
-            use_container_width=True,
-        )
+        # الأرشيف يبيّن Alerte كيف ما هي في الورقة
+        render_table(df_arch.drop(columns="Alerte_view"), key=f"archive::{employee}")
 
     st.markdown("---")
     st.subheader("🔁 نقل/استرجاع")
 
-    df_emp_all = df_all[df_all["__sheet_name"] == employee].copy()
     if df_emp_all.empty:
         st.caption("لا يوجد عملاء نشطين لنقلهم.")
     else:
-        move_opt = st.selectbox(
-            "اختر عميل للنقل إلى الأرشيف",
-            [
-                f"{r['Nom & Prénom']} — {format_display_phone(r['Téléphone'])}"
-                for _, r in df_emp_all.iterrows()
-            ],
+        move_phone = client_picker(
+            "اختر عميل للنقل إلى الأرشيف", "archive_pick", df_emp_all, title=employee
         )
-        if st.button("📦 نقل إلى الأرشيف"):
+        if st.button("📦 نقل إلى الأرشيف") and move_phone:
             try:
-                sh = get_spreadsheet()
-                ws_emp = sh.worksheet(employee)
-                vals = ws_emp.get_all_values()
-                header = vals[0] if vals else []
-                tel_idx = (
-                    header.index("Téléphonique")
-                    if "Téléphonique" in header
-                    else header.index("Téléphone")
-                )
-                phone_pick = normalize_tn_phone(move_opt.split("—")[-1])
-                row_idx = None
-                for i, r in enumerate(vals[1:], start=2):
-                    if len(r) > tel_idx and normalize_tn_phone(r[tel_idx]) == phone_pick:
-                        row_idx = i
-                        break
-                if not row_idx:
+                if move_client(storage, employee, ARCHIVE_SHEET, move_phone, get_sheet_store()) is None:
                     st.error("❌ لم يتم العثور على هذا العميل.")
                     st.stop()
-                row_values = ws_emp.row_values(row_idx)
-                if len(row_values) < len(EXPECTED_HEADERS):
-                    row_values += [""] * (len(EXPECTED_HEADERS) - len(row_values))
-                row_values = row_values[: len(EXPECTED_HEADERS)]
-                ws_arch.append_row(row_values)
-                ws_emp.delete_rows(row_idx)
+                storage_written()
                 st.success("✅ تم النقل للأرشيف")
-                st.cache_data.clear()
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ خطأ: {e}")
@@ -1247,48 +1124,37 @@ if tab_choice == "أرشيف" and role == "موظف" and employee:
     if df_arch.empty:
         st.caption("لا يوجد عملاء بالأرشيف للاسترجاع.")
     else:
-        restore_opt = st.selectbox(
-            "اختر عميل للاسترجاع",
-            [
-                f"{r['Nom & Prénom']} — {format_display_phone(r['Téléphone'])}"
-                for _, r in df_arch.iterrows()
-            ],
-            key="restore_pick",
+        restore_phone = client_picker(
+            "اختر عميل للاسترجاع", "restore_pick", df_arch, title=ARCHIVE_SHEET
         )
-        if st.button("♻️ استرجاع للورقة"):
+        if st.button("♻️ استرجاع للورقة") and restore_phone:
             try:
-                sh = get_spreadsheet()
-                ws_emp = sh.worksheet(employee)
-                valsA = ws_arch.get_all_values()
-                headerA = valsA[0] if valsA else []
-                tel_idxA = headerA.index("Téléphone")
-                phone_pick = normalize_tn_phone(restore_opt.split("—")[-1])
-                row_idx = None
-                for i, r in enumerate(valsA[1:], start=2):
-                    if len(r) > tel_idxA and normalize_tn_phone(r[tel_idxA]) == phone_pick:
-                        row_idx = i
-                        break
-                if not row_idx:
+                if move_client(storage, ARCHIVE_SHEET, employee, restore_phone, get_sheet_store()) is None:
                     st.error("❌ لم يتم العثور عليه في الأرشيف.")
                     st.stop()
-                row_values = ws_arch.row_values(row_idx)
-                if len(row_values) < len(EXPECTED_HEADERS):
-                    row_values += [""] * (len(EXPECTED_HEADERS) - len(row_values))
-                row_values = row_values[: len(EXPECTED_HEADERS)]
-                ws_emp.append_row(row_values)
-                ws_arch.delete_rows(row_idx)
+                storage_written()
                 st.success("✅ تم الاسترجاع")
-                st.cache_data.clear()
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ خطأ: {e}")
 
+# ============ Benchmark offline (megacrm_bench.py) ============
+# مخفي بشكل افتراضي: MEGACRM_BENCH=1 ولا bench = true في secrets → يبان في صفحة الأدمِن.
+BENCH_ENABLED = bool(os.environ.get("MEGACRM_BENCH") or secret("bench", False))
+
+if BENCH_ENABLED:
+    from megacrm_bench import RERUN_MEM_MULTIPLE, run_benchmarks
+
 # ============ صفحة الأدمِن ============
-if role == "أدمن":
+@section
+@profiled("admin")
+def render_admin():
     st.markdown("## 👑 لوحة الأدمِن")
+    render_write_status()
     if not admin_unlocked():
         st.info("🔐 أدخل كلمة سرّ الأدمِن من اليسار لفتح الصفحة.")
     else:
+        all_employes = load_all_data()
         colA, colB, colC = st.columns(3)
 
         # --- إضافة موظّف ---
@@ -1297,22 +1163,21 @@ if role == "أدمن":
             new_emp = st.text_input("اسم الموظّف الجديد")
             if st.button("إنشاء ورقة"):
                 try:
-                    sh = get_spreadsheet()
-                    titles = [w.title for w in sh.worksheets()]
+                    storage = get_storage()
+                    titles = storage.list_sheets()
                     if not new_emp or new_emp in titles:
                         st.warning("⚠️ الاسم فارغ أو موجود.")
                     else:
-                        sh.add_worksheet(title=new_emp, rows="1000", cols="20")
-                        sh.worksheet(new_emp).update("1:1", [EXPECTED_HEADERS])
+                        storage.add_sheet(new_emp, EXPECTED_HEADERS)
+                        storage_written()
                         st.success("✔️ تم الإنشاء")
-                        st.cache_data.clear()
+                        get_sheet_store().invalidate_sheets()
                 except Exception as e:
                     st.error(f"❌ خطأ: {e}")
 
         # --- إضافة عميل لأي موظف ---
         with colB:
             st.subheader("➕ إضافة عميل (لأي موظّف)")
-            sh = get_spreadsheet()
             target_emp = st.selectbox(
                 "اختر الموظّف", all_employes, key="admin_add_emp"
             )
@@ -1343,29 +1208,28 @@ if role == "أدمن":
                         st.error("❌ حقول ناقصة.")
                         st.stop()
                     tel_norm = normalize_tn_phone(tel_a)
-                    if tel_norm in set(df_all["Téléphone_norm"]):
+                    if tel_norm in get_sheet_store().phone_index:
                         st.warning("⚠️ الرقم موجود.")
                     else:
                         insc_val = "Oui" if inscription_a == "Inscrit" else "Pas encore"
-                        ws = sh.worksheet(target_emp)
-                        ws.append_row(
-                            [
-                                nom_a,
-                                tel_norm,
-                                fmt_date(date_naiss_a),
-                                type_contact_a,
-                                formation_a,
-                                remarque_a.strip(),
-                                fmt_date(date_ajout_a),
-                                fmt_date(suivi_date_a),
-                                "",
-                                insc_val,
-                                target_emp,
-                                "",
-                            ]
-                        )
+                        row_to_append = [
+                            nom_a,
+                            tel_norm,
+                            fmt_date(date_naiss_a),
+                            type_contact_a,
+                            formation_a,
+                            remarque_a.strip(),
+                            fmt_date(date_ajout_a),
+                            fmt_date(suivi_date_a),
+                            "",
+                            insc_val,
+                            target_emp,
+                            "",
+                        ]
+                        new_row = get_storage().append_row(target_emp, row_to_append)
+                        storage_written()
                         st.success("✅ تمت الإضافة")
-                        st.cache_data.clear()
+                        get_sheet_store().apply_append(target_emp, row_to_append, new_row)
                 except Exception as e:
                     st.error(f"❌ خطأ: {e}")
 
@@ -1377,45 +1241,166 @@ if role == "أدمن":
             )
             if st.button("❗ حذف الورقة كاملة"):
                 try:
-                    sh = get_spreadsheet()
-                    sh.del_worksheet(sh.worksheet(emp_to_delete))
+                    get_storage().delete_sheet(emp_to_delete)
+                    storage_written()
                     st.success("تم الحذف")
-                    st.cache_data.clear()
+                    get_sheet_store().invalidate(emp_to_delete)
+                    get_sheet_store().invalidate_sheets()
                 except Exception as e:
                     st.error(f"❌ خطأ: {e}")
 
-        st.markdown("---")
-        st.subheader("📜 سجلّ نقل العملاء")
-        wslog = ensure_ws(REASSIGN_LOG_SHEET, REASSIGN_LOG_HEADERS)
-        vals = wslog.get_all_values()
-        if vals and len(vals) > 1:
-            df_log = pd.DataFrame(vals[1:], columns=vals[0])
+        boot = startup_stats()
+        since = f" — السيرفر شغّال من {boot['started_at']:%Y-%m-%d %H:%M}"
+        if boot["first_render_ms"] is None:
+            st.caption("🚀 cold start: ما يتقاسش (psutil موش مثبّت)" + since)
+        else:
+            (st.warning if boot["first_render_ms"] > STARTUP_BUDGET_MS else st.caption)(
+                f"🚀 cold start (بداية العملية → أوّل render): {boot['first_render_ms']} ms"
+                f" (الميزانية {STARTUP_BUDGET_MS:.0f} ms)" + since
+            )
 
-            def _fmt_ts(x):
-                try:
-                    return (
-                        datetime.fromisoformat(x)
-                        .astimezone()
-                        .strftime("%Y-%m-%d %H:%M")
+        legacy_dates = {
+            t: n for t, n in get_sheet_store().date_fallbacks.items() if n
+        }
+        if legacy_dates:
+            st.caption(
+                "🗓️ تواريخ بصيغة غير dd/mm/YYYY (fallback): "
+                + "، ".join(f"{t}: {n}" for t, n in legacy_dates.items())
+            )
+
+        with st.expander("📡 نداءات Google Sheets (منذ تشغيل السيرفر)"):
+            if GATEWAY.calls:
+                st.dataframe(
+                    pd.DataFrame(
+                        {
+                            "calls": GATEWAY.calls,
+                            "retries": GATEWAY.retries,
+                            "errors": GATEWAY.errors,
+                            "waited_s": GATEWAY.waited,
+                        }
+                    ).fillna(0).round(2),
+                    use_container_width=True,
+                )
+            else:
+                st.caption("لا يوجد نداءات بعد.")
+
+        if PROFILER is not None:
+            with st.expander("⏱️ Profiling (الأقسام ونداءات Google Sheets)"):
+                summary = PROFILER.summary()
+                if summary.empty:
+                    st.caption("لا يوجد قياسات بعد.")
+                else:
+                    st.dataframe(
+                        summary.sort_values("total_ms", ascending=False),
+                        use_container_width=True,
                     )
-                except Exception:
-                    return x
-
-            if "timestamp" in df_log.columns:
-                df_log["وقت"] = df_log["timestamp"].apply(_fmt_ts)
-
-            show_cols = [
-                "وقت",
-                "moved_by",
-                "src_employee",
-                "dst_employee",
-                "client_name",
-                "phone",
-            ]
-            show_cols = [c for c in show_cols if c in df_log.columns]
-            st.dataframe(
-                df_log[show_cols].sort_values(show_cols[0], ascending=False),
-                use_container_width=True,
+                    st.markdown("##### توزيع زمن نداءات Google Sheets")
+                    st.dataframe(PROFILER.histogram(), use_container_width=True)
+                store = get_sheet_store()
+                if store.mem_report:
+                    st.caption(
+                        "🧮 الذاكرة حسب المرحلة: "
+                        + "، ".join(f"{k}: {v} MB" for k, v in store.mem_report.items())
+                    )
+                st.caption(
+                    "🗄️ كاش load_all_data: "
+                    + "، ".join(f"{k}={v}" for k, v in get_sheet_store().cache_stats.items())
+                )
+                p1, p2 = st.columns(2)
+                p1.download_button(
+                    "⬇️ JSON lines", PROFILER.jsonl(), file_name="megacrm_profile.jsonl"
+                )
+                if p2.button("🧹 تصفير"):
+                    PROFILER.reset()
+
+        if BENCH_ENABLED:
+            with st.expander("🧪 Benchmark offline (gspread وهمي)"):
+                b1, b2, b3, b4 = st.columns(4)
+                n_emp = b1.number_input("موظّفين", 2, 100, 10)
+                n_cli = b2.number_input("عملاء لكل موظّف", 10, 50000, 1000)
+                lat_ms = b3.number_input("latency لكل نداء (ms)", 0, 2000, 0)
+                fail_every = b4.number_input("429 كل n نداء (0 = لا)", 0, 1000, 0)
+                if st.button("▶️ شغّل الـ benchmark"):
+                    res = run_benchmarks(int(n_emp), int(n_cli), lat_ms / 1000, int(fail_every))
+                    if any(r.get("ok") is False for r in res):
+                        st.error(
+                            f"❌ الذاكرة في rerun كامل فاتت {RERUN_MEM_MULTIPLE}× مجموع أحجام frames الأوراق."
+                        )
+                    st.dataframe(pd.DataFrame(res), use_container_width=True)
+                    st.download_button(
+                        "⬇️ JSON lines",
+                        "\n".join(json.dumps(r, ensure_ascii=False) for r in res),
+                        file_name="megacrm_bench.jsonl",
+                    )
+
+        if STORAGE_BACKEND == "sqlite":
+            sync = get_sheets_sync()
+            if sync is None:
+                st.caption("💾 SQLite محلي — Google Sheets غير متاح (offline).")
+            else:
+                pending = len(get_sqlite_storage().outbox_items())
+                skipped = sum(sync.skipped.values())
+                st.caption(
+                    f"💾 SQLite محلي — في الانتظار للمزامنة: {pending}"
+                    + (f" — ⚠️ {sync.last_error}" if sync.last_error else "")
+                    + (f" — {skipped} عملية تطيّحت (العميل ما عادش في Google Sheets)" if skipped else "")
+                )
+                if st.button("🔄 مزامنة مع Google Sheets الآن"):
+                    try:
+                        sync.push()
+                        sync.pull()
+                        get_sheet_store().invalidate_all()
+                        st.success("✅ تمت المزامنة")
+                    except Exception as e:
+                        st.error(f"❌ خطأ: {e}")
+
+        st.markdown("---")
+        st.subheader("📜 سجلّ نقل العملاء")
+        storage = get_storage()
+        storage.ensure_sheet(REASSIGN_LOG_SHEET, REASSIGN_LOG_HEADERS)
+        c1, c2 = st.columns(2)
+        since = c1.date_input("من تاريخ (اختياري)", value=None, key="log_since")
+        more = c2.button("⬆️ حمّل عمليات أقدم")
+        rows, has_older = reassign_log_rows(storage, more=more, since=since)
+        if rows:
+            width = len(REASSIGN_LOG_HEADERS)
+            df_log = pd.DataFrame(
+                [(list(r) + [""] * width)[:width] for r in rows], columns=REASSIGN_LOG_HEADERS
+            )
+            ts = parse_log_ts(df_log["timestamp"])
+            if since is not None:
+                # مقارنة timestamps (موش .dt.date) باش عمود كلّو NaT ما يطيّحش
+                keep = ts >= pd.Timestamp(since).tz_localize(ts.dt.tz)
+                df_log, ts = df_log[keep], ts[keep]
+            df_log = df_log.assign(
+                **{"وقت": ts.dt.strftime("%Y-%m-%d %H:%M").fillna(df_log["timestamp"])}
+            )
+            show_cols = ["وقت"] + REASSIGN_LOG_HEADERS[1:]
+            # السجلّ مرتّب بالوقت: الأحدث الفوق بلا sort
+            st.dataframe(df_log[show_cols].iloc[::-1], use_container_width=True)
+            st.caption(
+                f"{len(df_log)} عملية" + (" — فمّا عمليات أقدم موش محمّلة" if has_older else "")
             )
         else:
             st.caption("لا يوجد سجلّ نقل.")
+
+# ============ Router: نحسبو كان الأقسام اللي تبان للتبويب/الدور ============
+# الإحصائيات والبحث فيهم داتا: ما يتحمّلو كان بعد القفل (صفحة مقفولة = list_sheets برك)
+if tab_choice == "CRM":
+    if role == "أدمن":
+        if admin_unlocked():
+            render_dashboard()
+            render_global_search()
+    elif employee:
+        if emp_unlocked(employee):
+            # في حدود ورقة الموظّف + فهرس الهواتف: أوراق الآخرين كاملة تتخلّى للأدمِن
+            render_dashboard(employee)
+            render_global_search(employee)
+        render_employee_crm(employee)
+elif tab_choice == "أرشيف" and role == "موظف" and employee:
+    render_archive(employee)
+
+if role == "أدمن":
+    render_admin()
+
+mark_first_render()
@@ -0,0 +1,346 @@
+# megacrm_bench.py
+# Benchmark offline: gspread وهمي + داتا اصطناعية. MegaCRM_Streamlit.py يستوردو كان بـ
+# MEGACRM_BENCH=1 ولا bench = true في secrets؛ الـ tests يستعملو نفس الـ fakes.
+
+import json, random, re, time, tracemalloc
+import pandas as pd
+import gspread
+import gspread.exceptions as gse
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from collections import Counter
+from datetime import date, timedelta
+
+from megacrm_core import (
+    ARCHIVE_SUFFIX, EXPECTED_HEADERS, SheetStore, SheetsGateway, SheetsStorage,
+    a1_sheet, derive_columns, find_client_row, fmt_date, frame_mb,
+    move_client, normalize_tn_phone, normalize_tn_phone_series, open_spreadsheet,
+    rows_to_frame, table_styles, use_gateway,
+)
+
+class FakeResponse:
+    """يكفي باش gse.APIError يتبنى (429 الكوتا، 5xx، 400 خارج الـ grid)."""
+
+    def __init__(self, code: int):
+        self.status_code = code
+        self.text = json.dumps(self.json())
+
+    def json(self):
+        status = "RESOURCE_EXHAUSTED" if self.status_code == 429 else "INVALID_ARGUMENT"
+        return {"error": {"code": self.status_code, "message": f"fake {status.lower()}", "status": status}}
+
+class FakeBackend:
+    """الحالة المشتركة للـ fakes: كل نداء يتسجّل، latency، و 429 كل fail_every نداء."""
+
+    def __init__(self, latency: float = 0.0, fail_every: int = 0):
+        self.calls = Counter()
+        self.latency = latency
+        self.fail_every = fail_every
+        self.n = 0
+
+    def hit(self, method: str):
+        self.calls[method] += 1
+        self.n += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_every and self.n % self.fail_every == 0:
+            raise gse.APIError(FakeResponse(429))
+
+class FakeWorksheet:
+    def __init__(self, backend: FakeBackend, sheet_id: int, title: str, rows: list[list[str]]):
+        self.backend = backend
+        self.id = sheet_id
+        self.title = title
+        self.rows = [list(r) for r in rows]
+        self.row_count = len(self.rows)  # الـ grid: appends يكبّروه، delete_rows يصغّرو
+
+    def _grow(self):
+        self.row_count = max(self.row_count, len(self.rows))
+
+    def row_values(self, row: int) -> list[str]:
+        self.backend.hit("row_values")
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def update(self, rng: str, values: list[list[str]]):
+        self.backend.hit("update")
+        if self.rows:
+            self.rows[0] = list(values[0])
+        else:
+            self.rows.append(list(values[0]))
+        self._grow()
+
+    def append_row(self, values: list, **kwargs):
+        self.backend.hit("append_row")
+        self.rows.append([str(v) for v in values])
+        self._grow()
+        n = len(self.rows)
+        return {"updates": {"updatedRange": f"{a1_sheet(self.title)}!A{n}:{rowcol_to_a1(n, len(values))}"}}
+
+    def append_rows(self, rows: list[list], **kwargs):
+        self.backend.hit("append_rows")
+        self.rows += [[str(v) for v in r] for r in rows]
+        self._grow()
+
+    def batch_update(self, data: list[dict], **kwargs):
+        self.backend.hit("batch_update")
+        for d in data:
+            r, c = a1_to_rowcol(d["range"])
+            while len(self.rows) < r:
+                self.rows.append([])
+            row = self.rows[r - 1]
+            row += [""] * (c - len(row))
+            row[c - 1] = str(d["values"][0][0])
+        self._grow()
+
+    def delete_rows(self, row: int):
+        self.backend.hit("delete_rows")
+        del self.rows[row - 1]
+        self.row_count -= 1
+
+class FakeSpreadsheet:
+    """Spreadsheet في الذاكرة: نفس النداءات اللي يستعملها SheetsStorage."""
+
+    def __init__(self, backend: FakeBackend, sheets: dict[str, list[list[str]]]):
+        self.backend = backend
+        self._ws = {
+            t: FakeWorksheet(backend, i, t, rows) for i, (t, rows) in enumerate(sheets.items())
+        }
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.backend.hit("worksheet")
+        if title not in self._ws:
+            raise gspread.WorksheetNotFound(title)
+        return self._ws[title]
+
+    def worksheets(self) -> list[FakeWorksheet]:
+        self.backend.hit("worksheets")
+        return list(self._ws.values())
+
+    def add_worksheet(self, title: str, rows: str, cols: str) -> FakeWorksheet:
+        self.backend.hit("add_worksheet")
+        ws = self._ws[title] = FakeWorksheet(self.backend, len(self._ws) + 1000, title, [])
+        ws.row_count = int(rows)
+        return ws
+
+    def del_worksheet(self, ws: FakeWorksheet):
+        self.backend.hit("del_worksheet")
+        del self._ws[ws.title]
+
+    def _read(self, a1: str) -> list[list[str]]:
+        title, _, rng = a1.partition("!") if a1.startswith("'") and "'!" in a1 else (a1, "", "")
+        ws = self._ws[title[1:-1].replace("''", "'")]
+        rows = ws.rows
+        # "A:A"، "A5:A"، "2:10"، خانة "A5"، ولا "" (الورقة كاملة)
+        m = re.fullmatch(r"([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?", rng)
+        single = m[3] is None
+        first = int(m[2] or 1)
+        last = int(m[2]) if single and m[2] else int(m[4] or 0) or len(rows)
+        if first > max(ws.row_count, 1):
+            raise gse.APIError(FakeResponse(400))  # خارج الـ grid
+        cols = slice(None)
+        if m[1]:
+            c1 = a1_to_rowcol(m[1] + "1")[1]
+            c2 = a1_to_rowcol((m[1] if single else m[3] or m[1]) + "1")[1]
+            cols = slice(c1 - 1, c2)
+        col = [r[cols] for r in rows[first - 1 : last]]
+        while col and not any(col[-1]):
+            col = col[:-1]
+        return [list(r) for r in col]
+
+    def values_batch_get(self, ranges: list[str]):
+        self.backend.hit("values_batch_get")
+        return {"valueRanges": [{"values": self._read(r)} for r in ranges]}
+
+    def values_get(self, rng: str):
+        self.backend.hit("values_get")
+        return {"values": self._read(rng)}
+
+    def batch_update(self, body: dict):
+        self.backend.hit("batch_update")
+        by_id = {ws.id: ws for ws in self._ws.values()}
+        for req in body["requests"]:
+            if "appendCells" in req:
+                ws = by_id[req["appendCells"]["sheetId"]]
+                for r in req["appendCells"]["rows"]:
+                    ws.rows.append([c["userEnteredValue"]["stringValue"] for c in r["values"]])
+                ws._grow()
+            elif "deleteDimension" in req:
+                rng = req["deleteDimension"]["range"]
+                ws = by_id[rng["sheetId"]]
+                del ws.rows[rng["startIndex"] : rng["endIndex"]]
+                ws.row_count -= rng["endIndex"] - rng["startIndex"]
+
+class FakeClient:
+    def __init__(self, sh: FakeSpreadsheet):
+        self.sh = sh
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.sh.backend.hit("open_by_key")
+        return self.sh
+
+BENCH_FORMATIONS = ["Anglais", "Français", "Informatique", "Comptabilité", "Marketing", "Esthétique"]
+BENCH_CONTACTS = ["Visiteur", "Appel téléphonique", "WhatsApp", "Social media"]
+
+def synth_sheets(n_emp: int = 10, n_clients: int = 1000, seed: int = 0) -> dict[str, list[list[str]]]:
+    """n_emp ورقة × n_clients عميل: تواريخ على عامين، هواتف فريدة، ملاحظات، 5% تواريخ بصيغة قديمة."""
+    rng = random.Random(seed)
+    today = date.today()
+    phones = iter(rng.sample(range(20_000_000, 99_999_999), n_emp * n_clients))
+    sheets = {}
+    for e in range(n_emp):
+        emp = f"Employe{e + 1:02d}"
+        rows = [list(EXPECTED_HEADERS)]
+        for i in range(n_clients):
+            ajout = today - timedelta(days=rng.randint(0, 720))
+            suivi = ajout + timedelta(days=rng.randint(0, 30))
+            notes = "\n".join(
+                f"[{fmt_date(ajout + timedelta(days=k))} 10:00] rappel {k}"
+                for k in range(rng.randint(0, 3))
+            )
+            rows.append([
+                f"Client {e}-{i}",
+                f"216{next(phones)}",
+                fmt_date(date(1975, 1, 1) + timedelta(days=rng.randint(0, 12000))),
+                rng.choice(BENCH_CONTACTS),
+                rng.choice(BENCH_FORMATIONS),
+                notes,
+                ajout.isoformat() if rng.random() < 0.05 else fmt_date(ajout),
+                fmt_date(suivi),
+                "",
+                "Oui" if rng.random() < 0.3 else "Pas encore",
+                emp,
+                rng.choice(["", "", "", "#00AA88", "#FF5733"]),
+            ])
+        sheets[emp] = rows
+    return sheets
+
+PHONE_BENCH_ROWS = 40_000
+
+def synth_raw_phones(sheets: dict[str, list[list[str]]], n: int = PHONE_BENCH_ROWS) -> pd.Series:
+    """n هاتف بصيغ كيما يكتبوهم الموظّفين (+216، 00216، 8 أرقام، فواصل، خانات فارغة)."""
+    local = [row[1][3:] for rows in sheets.values() for row in rows[1:]]
+    forms = [
+        lambda p: p, lambda p: "216" + p, lambda p: f"+216 {p[:2]} {p[2:5]} {p[5:]}",
+        lambda p: "00216" + p, lambda p: f"{p[:2]}-{p[2:5]}-{p[5:]}", lambda p: "",
+    ]
+    return pd.Series(
+        [forms[i % len(forms)](local[i % len(local)]) for i in range(n)], dtype=object
+    )
+
+def bench_step(results: list[dict], backend: FakeBackend, name: str, fn):
+    """يشغّل fn ويسجّل wall time، peak memory (tracemalloc) ونداءات الـ API الحقيقية."""
+    before = Counter(backend.calls)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        out = fn()
+    finally:
+        wall = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    calls = backend.calls - before
+    results.append({
+        "bench": name,
+        "wall_ms": round(wall * 1000, 1),
+        "peak_mb": round(peak / 2**20, 2),
+        "api_calls": sum(calls.values()),
+        "calls": dict(calls),
+    })
+    return out
+
+RERUN_MEM_MULTIPLE = 1.0  # peak متاع rerun كامل ≤ هالقدّ × مجموع أحجام frames الأوراق
+
+def simulate_rerun(store: SheetStore, storage, employee: str) -> int:
+    """مسار القراية متاع rerun كامل (dashboard أدمِن + شهري + لوحة موظّف + تقرير) بلا UI."""
+    store.load(storage)
+    cube = store.stats_cube()
+    month = cube["MonthStr"].dropna().iloc[0]
+    cube[cube["MonthStr"] == month].groupby("__sheet_name", sort=False, observed=True)[
+        ["Clients", "Inscrits", "Alerts"]
+    ].sum()
+    emp, _ = store.load_employee(storage, employee)
+    filtered = emp[emp["Mois"] == emp["Mois"].dropna().iloc[0]]
+    view = filtered.head(50)
+    table_styles(view[EXPECTED_HEADERS].assign(Alerte=view["Alerte_view"]))
+    alerts = filtered[filtered["Alerte_view"].astype(str).str.strip() != ""]
+    today_ts = pd.Timestamp(date.today())
+    today_rows = emp[emp["DateAjout_dt"].dt.normalize() == today_ts]
+    contacts = emp[emp["DateSuivi_dt"].dt.normalize() == today_ts]
+    return len(alerts) + len(today_rows) + len(contacts) + ("21611111111" in store.phone_index)
+
+def run_benchmarks(
+    n_emp: int = 10, n_clients: int = 1000, latency: float = 0.0, fail_every: int = 0
+) -> list[dict]:
+    """load/derive/cube/table + كل مسارات الكتابة على gspread وهمي (بلا limiter).
+
+    wall time يتحسب مع tracemalloc شغّال، يعني أبطأ شوية من الحقيقة؛ المهم المقارنة بين نسخ.
+    """
+    backend = FakeBackend(latency=latency, fail_every=fail_every)
+    sheets = synth_sheets(n_emp, n_clients)
+    results: list[dict] = []
+    with use_gateway(SheetsGateway(read_per_min=None, write_per_min=None)):
+        sh = open_spreadsheet(FakeClient(FakeSpreadsheet(backend, sheets)), "bench")
+        storage = SheetsStorage(sh)
+        scoped = SheetStore()
+        bench_step(results, backend, "load_employee_data (cold)",
+                   lambda: scoped.load_employee(storage, next(iter(sheets))))
+        results[-1]["phones_indexed"] = len(scoped.phone_index)
+        store = SheetStore()
+        store.track_memory = True
+        emps = bench_step(results, backend, "load_all_data (cold)", lambda: store.load(storage))
+        bench_step(results, backend, "load_all_data (warm)", lambda: store.load(storage))
+
+        raw = [rows_to_frame(t, rows) for t, rows in sheets.items()]
+        bench_step(results, backend, "derive_columns (all sheets)",
+                   lambda: derive_columns(pd.concat(raw, ignore_index=True)))
+        raw_phones = synth_raw_phones(sheets)
+        vec = bench_step(results, backend, f"normalize phones (.str, {len(raw_phones)})",
+                         lambda: normalize_tn_phone_series(raw_phones))
+        slow = bench_step(results, backend, f"normalize phones (apply, {len(raw_phones)})",
+                          lambda: raw_phones.apply(normalize_tn_phone))
+        results[-1]["same_result"] = vec.tolist() == slow.tolist()
+        bench_step(results, backend, "stats cube (monthly)", lambda: store.stats_cube())
+        big = pd.concat([store.frames[t][1] for t in emps], ignore_index=True)
+        view = big[EXPECTED_HEADERS].assign(Alerte=big["Alerte_view"])
+        bench_step(results, backend, "render_table (page 50)",
+                   lambda: view.head(50).style.apply(table_styles, axis=None).to_html())
+        bench_step(results, backend, "table_styles (all rows)", lambda: table_styles(view))
+
+        src, dst = emps[0], emps[1 % len(emps)]
+        del big
+        base_mb = round(sum(frame_mb(store.frames[t][1]) for t in emps), 2)
+        bench_step(results, backend, "full rerun (read path)", lambda: simulate_rerun(store, storage, src))
+        limit = round(float(base_mb) * RERUN_MEM_MULTIPLE, 2)
+        # أنواع Python (موش numpy) باش التصدير JSON lines يخدم
+        results[-1].update(
+            base_mb=float(base_mb), limit_mb=float(limit), ok=bool(results[-1]["peak_mb"] <= limit)
+        )
+        phones = store.frames[src][1]["Téléphone_norm"].tolist()
+        new_row = [f"Bench {n_clients}", "21611111111", "", "WhatsApp", "Anglais", "",
+                   fmt_date(date.today()), fmt_date(date.today()), "", "Pas encore", src, ""]
+
+        def add():
+            store.apply_append(src, new_row, storage.append_row(src, new_row))
+
+        def edit(phone, updates):
+            row_idx, _ = find_client_row(storage, src, phone, store)
+            storage.update_cells(src, row_idx, {EXPECTED_HEADERS.index(h) + 1: v for h, v in updates.items()})
+            store.apply_update(src, phone, updates, sheet_row=row_idx)
+
+        bench_step(results, backend, "add client", add)
+        bench_step(results, backend, "edit client",
+                   lambda: edit(phones[1], {"Formation": "Marketing", "Remarque": "bench"}))
+        bench_step(results, backend, "tag client", lambda: edit(phones[2], {"Tag": "#123456"}))
+        bench_step(results, backend, "reassign",
+                   lambda: move_client(storage, src, dst, phones[3], store, reassign_by="bench"))
+        archive = f"{src}{ARCHIVE_SUFFIX}"
+
+        def to_archive():
+            storage.ensure_sheet(archive, EXPECTED_HEADERS)
+            store.frame(storage, archive)
+            return move_client(storage, src, archive, phones[4], store)
+
+        bench_step(results, backend, "archive", to_archive)
+        bench_step(results, backend, "restore",
+                   lambda: move_client(storage, archive, src, phones[4], store))
+    results += [{"bench": f"memory: {k}", "mem_mb": v} for k, v in store.mem_report.items()]
+    return results
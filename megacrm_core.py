@@ -0,0 +1,1743 @@
+# megacrm_core.py
+# المنطق متاع MegaCRM بلا واجهة: helpers، Google Sheets/SQLite، الكاش (SheetStore)
+# يتستورد بلا Streamlit (tests، benchmark)؛ MegaCRM_Streamlit.py فيه الواجهة والـ singletons
+
+import bisect, functools, itertools, json, os, queue, random, re, sqlite3, time, threading
+import pandas as pd
+import gspread
+import gspread.exceptions as gse
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, date, timezone
+
+try:
+    import psutil
+except ImportError:  # اختياري: بلاه الـ cold start ما يتقاسش
+    psutil = None
+
+# ============ ثوابت الجداول ============
+EXPECTED_HEADERS = [
+    "Nom & Prénom",      # 0
+    "Téléphone",         # 1
+    "Date de naissance", # 2
+    "Type de contact",   # 3
+    "Formation",         # 4
+    "Remarque",          # 5
+    "Date ajout",        # 6
+    "Date de suivi",     # 7
+    "Alerte",            # 8
+    "Inscription",       # 9
+    "Employe",           # 10
+    "Tag",               # 11,
+]
+
+REASSIGN_LOG_SHEET   = "Reassign_Log"
+ARCHIVE_SUFFIX       = "_Archive"
+REASSIGN_LOG_HEADERS = ["timestamp","moved_by","src_employee","dst_employee","client_name","phone"]
+
+# ============ Helpers ============
+def fmt_date(d: date | None) -> str:
+    return d.strftime("%d/%m/%Y") if isinstance(d, date) else ""
+
+def normalize_tn_phone(s: str) -> str:
+    digits = "".join(ch for ch in str(s) if ch.isdigit())
+    if digits.startswith("216"):
+        return digits
+    if len(digits) == 8:
+        return "216" + digits
+    return digits
+
+def normalize_tn_phone_series(s: pd.Series) -> pd.Series:
+    """نفس نتيجة normalize_tn_phone لعمود كامل، بعمليات pandas .str."""
+    # خانات فارغة (None/NaN) → "" كيما الدالة العادية (astype(str) وحدو يخلّي NaN في pandas 3)
+    s = s.fillna("").astype(str)
+    digits = s.str.replace(r"[^0-9]", "", regex=True)
+    # isdigit() يقبل أرقام Unicode (٠-٩…): الصفوف هاذي فقط تتعدّى بالدالة العادية
+    exotic = s.str.contains(r"[^\x00-\x7f]", regex=True)
+    if exotic.any():
+        digits[exotic] = s[exotic].map(
+            lambda v: "".join(ch for ch in v if ch.isdigit())
+        )
+    local8 = digits.str.len().eq(8) & ~digits.str.startswith("216")
+    return digits.mask(local8, "216" + digits)
+
+def format_display_phone(s: str) -> str:
+    d = "".join(ch for ch in str(s) if ch.isdigit())
+    return f"+{d}" if d else ""
+
+def _css_add(base: pd.Series, extra) -> pd.Series:
+    return base.where(base.eq(""), base + ";") + extra
+
+def table_styles(view: pd.DataFrame) -> pd.DataFrame:
+    """CSS لكل خانة بعمليات vectorized: صف inscrit + خانة Alerte + لون Tag."""
+    css = pd.DataFrame("", index=view.index, columns=view.columns)
+    if "Inscription" in view.columns:
+        insc = view["Inscription"].astype(str).str.strip().str.lower()
+        css.loc[insc.isin(["inscrit", "oui"]), :] = "background-color:#d6f5e8"
+    if "Alerte" in view.columns:
+        alert = view["Alerte"].astype(str).str.strip()
+        late = alert.str.contains("متأخر", regex=False)
+        for mask, style in (
+            (alert.ne("") & late, "background-color:#ffe6b3;color:#7a4e00"),
+            (alert.ne("") & ~late, "background-color:#ffcccc;color:#7a0000"),
+        ):
+            css.loc[mask, "Alerte"] = _css_add(css.loc[mask, "Alerte"], style)
+    if "Tag" in view.columns:
+        tag = view["Tag"].astype(str)
+        tag_s = tag.str.strip()
+        is_hex = tag_s.str.startswith("#") & tag_s.str.len().eq(7)
+        css.loc[is_hex, "Tag"] = _css_add(
+            css.loc[is_hex, "Tag"], "background-color: " + tag[is_hex] + "; color: white;"
+        )
+    return css
+
+PICKER_TOP_K = 20  # أقصى عدد نتائج يتبعث للمتصفّح في كل picker
+PHONE_QUERY = re.compile(r"[+(]*\d[\d\s+()./-]*")  # query فيها رقم هاتف برك
+
+def build_client_index(df: pd.DataFrame) -> tuple[list[tuple[str, str]], dict[str, str]]:
+    """([(token، هاتف)] مرتّبة للبحث بالـ prefix، {هاتف: نصّ العرض})."""
+    phones = df["Téléphone_norm"].astype(str)
+    names = df["Nom & Prénom"].astype(str).str.strip()
+    shown = ("+" + phones).where(phones.ne(""), "")
+    labels = dict(zip(phones, names + " — " + shown))
+    labels.pop("", None)
+    tokens = []
+    for name, ph in zip(names.str.lower(), phones):
+        if not ph:
+            continue
+        tokens.extend((t, ph) for t in name.split())
+        tokens.append((ph, ph))
+        if ph.startswith("216"):
+            tokens.append((ph[3:], ph))  # الرقم المحلّي (8 أرقام)
+    tokens.sort()
+    return tokens, labels
+
+def search_client_index(
+    tokens: list[tuple[str, str]], query: str, limit: int = PICKER_TOP_K, scope=None
+) -> list[str]:
+    """هواتف العملاء اللي كل كلمة في query هي بداية token متاعهم (prefix)."""
+    words = query.lower().split()
+    if PHONE_QUERY.fullmatch(query.strip()):
+        # رقم مقسوم ("22 123 456"، "+216 22-123-456") → كلمة وحدة أرقام برك؛ 00 = بادئة دولية
+        digits = "".join(ch for ch in query if ch.isdigit())
+        words = [digits[2:] if digits.startswith("00") else digits]
+    result = None
+    for word in words:
+        digits = "".join(ch for ch in word if ch.isdigit())
+        word = digits if digits and len(digits) == len(word.lstrip("+")) else word
+        lo = bisect.bisect_left(tokens, (word, ""))
+        hits = {}
+        for t, ph in tokens[lo:]:
+            if not t.startswith(word):
+                break
+            hits.setdefault(ph, None)
+        result = hits if result is None else {ph: None for ph in result if ph in hits}
+    out = []
+    for ph in result or {}:
+        if scope is None or ph in scope:
+            out.append(ph)
+            if len(out) >= limit:
+                break
+    return out
+
+# ===================== Sheets Utils (Backoff + Cache) =====================
+# الكوتا متاع Google Sheets: 60 قراية و 60 كتابة في الدقيقة لكل مستعمل (service account)
+SHEETS_READ_PER_MIN = int(os.environ.get("MEGACRM_READ_PER_MIN", 60))
+SHEETS_WRITE_PER_MIN = int(os.environ.get("MEGACRM_WRITE_PER_MIN", 60))
+SHEETS_RETRIES = 5
+WRITE_METHODS = {
+    "append_row", "append_rows", "batch_update", "update", "update_cell",
+    "delete_rows", "add_worksheet", "del_worksheet", "move_row",
+}
+# نداءات تزيد صفوف: 5xx ينجم يكون تطبّق → نعاودو كان على 429 (ما تطبّقش أكيد)
+APPEND_METHODS = {"append_row", "append_rows", "move_row"}
+
+def is_retryable(e: Exception, method: str = "") -> bool:
+    """429 (الكوتا) و 5xx نعاودوهم؛ البقية أخطاء حقيقية."""
+    code = getattr(getattr(e, "response", None), "status_code", None)
+    if not isinstance(e, gse.APIError):
+        return False
+    return code == 429 or ((code or 0) >= 500 and method not in APPEND_METHODS)
+
+class TokenBucket:
+    """per_min طلب في الدقيقة، مع burst صغير. take() يستنّى (يحجز دورو) بدل ما يفشل."""
+
+    def __init__(self, per_min: int | None, burst: int | None = None):
+        self.unlimited = per_min is None  # مثلاً للـ backend الوهمي في الـ benchmark
+        self.rate = (per_min or 1) / 60.0
+        self.capacity = burst or max((per_min or 1) // 6, 1)
+        self.tokens = float(self.capacity)
+        self.at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        if self.unlimited:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.at) * self.rate)
+            self.at = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+# ============ Profiling (مخفي، مطفي بشكل افتراضي) ============
+PROFILE_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def process_started_at() -> float | None:
+    """وقت بداية العملية (epoch) من النظام، None كان psutil موش مثبّت."""
+    return psutil.Process().create_time() if psutil is not None else None
+
+class Profiler:
+    """أوقات الأقسام ونداءات Google Sheets للعملية الكل (آخر 5000 حدث للتصدير)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events: deque = deque(maxlen=5000)
+        self.totals = Counter()  # (kind, name) → ms
+        self.counts = Counter()  # (kind, name) → عدد
+        self.hist: dict[str, Counter] = {}  # نداء Sheets → {حدّ الـ bucket بالـ ms: عدد}
+
+    def record(self, kind: str, name: str, ms: float, **extra):
+        with self.lock:
+            self.totals[(kind, name)] += ms
+            self.counts[(kind, name)] += 1
+            if kind == "sheets":
+                bucket = next((b for b in PROFILE_BUCKETS_MS if ms <= b), float("inf"))
+                self.hist.setdefault(name, Counter())[bucket] += 1
+            self.events.append(
+                {"ts": round(time.time(), 3), "kind": kind, "name": name, "ms": round(ms, 2), **extra}
+            )
+
+    def summary(self) -> pd.DataFrame:
+        with self.lock:
+            rows = [
+                {"kind": k, "name": n, "count": c, "total_ms": round(self.totals[(k, n)], 1),
+                 "avg_ms": round(self.totals[(k, n)] / c, 1)}
+                for (k, n), c in self.counts.items()
+            ]
+        return pd.DataFrame(rows)
+
+    def histogram(self) -> pd.DataFrame:
+        with self.lock:
+            hist = {m: dict(h) for m, h in self.hist.items()}
+        cols = [*PROFILE_BUCKETS_MS, float("inf")]
+        return (
+            pd.DataFrame.from_dict(hist, orient="index")
+            .reindex(columns=cols, fill_value=0)
+            .fillna(0)
+            .astype(int)
+            .rename(columns=lambda b: f"≤{b}ms" if b != float("inf") else f">{PROFILE_BUCKETS_MS[-1]}ms")
+        )
+
+    def jsonl(self) -> str:
+        with self.lock:
+            return "\n".join(json.dumps(e, ensure_ascii=False) for e in self.events)
+
+    def reset(self):
+        with self.lock:
+            self.events.clear()
+            self.totals.clear()
+            self.counts.clear()
+            self.hist.clear()
+
+PROFILER: Profiler | None = None  # الواجهة تشعلو بـ enable_profiler()
+
+def enable_profiler() -> Profiler:
+    """Profiler وحيد للعملية (الـ module يتستورد مرّة، موش في كل rerun)."""
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = Profiler()
+    return PROFILER
+
+
+@contextmanager
+def timed(kind: str, name: str):
+    if PROFILER is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        PROFILER.record(kind, name, (time.perf_counter() - t0) * 1000)
+
+def profiled(name: str):
+    """decorator لقسم: مطفي → نرجّعو نفس الدالة (صفر كلفة)."""
+    def deco(fn):
+        if PROFILER is None:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed("section", name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+class SheetsGateway:
+    """بوابة وحدة لكل نداءات Google Sheets في العملية: limiter + retry + عدّادات."""
+
+    def __init__(self, read_per_min=SHEETS_READ_PER_MIN, write_per_min=SHEETS_WRITE_PER_MIN):
+        self.read = TokenBucket(read_per_min)
+        self.write = TokenBucket(write_per_min)
+        self.lock = threading.Lock()
+        self.calls = Counter()  # method → عدد النداءات
+        self.retries = Counter()  # method → عدد المعاودات (429/5xx)
+        self.errors = Counter()  # method → أخطاء نهائية
+        self.waited = Counter()  # method → ثواني تستنّى في الـ limiter
+
+    def call(self, method: str, fn, *args, **kwargs):
+        bucket = self.write if method in WRITE_METHODS else self.read
+        for i in range(SHEETS_RETRIES):
+            waited = bucket.take()
+            with self.lock:
+                self.calls[method] += 1
+                self.waited[method] += waited
+            t0 = time.perf_counter()
+            try:
+                out = fn(*args, **kwargs)
+            except Exception as e:
+                if PROFILER is not None:
+                    PROFILER.record(
+                        "sheets", method, (time.perf_counter() - t0) * 1000,
+                        attempt=i, waited_ms=round(waited * 1000, 1), error=type(e).__name__,
+                    )
+                if not is_retryable(e, method) or i == SHEETS_RETRIES - 1:
+                    with self.lock:
+                        self.errors[method] += 1
+                    raise
+                with self.lock:
+                    self.retries[method] += 1
+                time.sleep(min(2**i, 32) * (0.5 + random.random()))
+            else:
+                if PROFILER is not None:
+                    PROFILER.record(
+                        "sheets", method, (time.perf_counter() - t0) * 1000,
+                        attempt=i, waited_ms=round(waited * 1000, 1),
+                    )
+                return out
+
+GATEWAY = SheetsGateway()  # limiter + عدّادات مشتركة للعملية الكل
+_api_local = threading.local()
+
+def sheets_call(method: str, fn, *args, **kwargs):
+    """نداء Google Sheets محسوب (method = اسم النداء في العدّاد) عبر GATEWAY."""
+    counter = getattr(_api_local, "counter", None)
+    if counter is not None:
+        counter[method] += 1
+    gateway = getattr(_api_local, "gateway", None) or GATEWAY
+    return gateway.call(method, fn, *args, **kwargs)
+
+@contextmanager
+def use_gateway(gateway: "SheetsGateway"):
+    """gateway آخر للـ thread هذا برك (الـ benchmark بلا limiter)."""
+    prev = getattr(_api_local, "gateway", None)
+    _api_local.gateway = gateway
+    try:
+        yield gateway
+    finally:
+        _api_local.gateway = prev
+
+@contextmanager
+def count_api_calls():
+    """يعدّ نداءات sheets_call في الـ thread متاع الجلسة (مثلاً لكل حفظ)."""
+    prev = getattr(_api_local, "counter", None)
+    counter = _api_local.counter = Counter()
+    try:
+        yield counter
+    finally:
+        _api_local.counter = prev
+
+def open_spreadsheet(client, sheet_id: str):
+    return sheets_call("open_by_key", client.open_by_key, sheet_id)
+
+# ============ تحميل كل أوراق الموظفين (باستعمال أسماء الأعمدة) ============
+SHEETS_BATCH_SIZE = 40  # أقصى عدد أوراق في طلب values_batch_get واحد
+COLUMN_PROBES = 32  # خانات في كل values_batch_get متاع البحث في عمود مرتّب (_probe)
+
+def is_employee_sheet(title: str) -> bool:
+    # نستثني أوراق المداخيل والأنظمة الداخلية
+    if title.endswith("_PAIEMENTS"):
+        return False
+    if title.endswith(ARCHIVE_SUFFIX):  # الأرشيف: عمود الهاتف برك، والورقة كاملة في تبويبو
+        return False
+    if title.startswith("_"):
+        return False
+    if title in (REASSIGN_LOG_SHEET,):
+        return False
+    return True
+
+def a1_sheet(title: str) -> str:
+    return "'" + title.replace("'", "''") + "'"
+
+def batch_get_values(
+    sh, titles: list[str], rng: str = ""
+) -> dict[str, list[list[str]]]:
+    """كل الأوراق في طلب (أو بضعة طلبات) values_batch_get بدل get_all_values لكل ورقة.
+
+    rng (مثلاً "B:B"): نفس الـ range في كل ورقة بدل الورقة كاملة.
+    """
+    suffix = f"!{rng}" if rng else ""
+    out = {}
+    for i in range(0, len(titles), SHEETS_BATCH_SIZE):
+        chunk = titles[i : i + SHEETS_BATCH_SIZE]
+        resp = sheets_call(
+            "values_batch_get", sh.values_batch_get, [a1_sheet(t) + suffix for t in chunk]
+        )
+        # valueRanges ترجع بنفس ترتيب الطلب
+        for t, vr in zip(chunk, resp.get("valueRanges", [])):
+            out[t] = vr.get("values", [])
+    return out
+
+def rows_to_frame(title: str, rows: list[list[str]]) -> pd.DataFrame:
+    header_row = rows[0] if rows else []
+    data_rows = rows[1:] if len(rows) > 1 else []
+
+    # مابينغ من اسم العمود → index
+    header_map = {str(name).strip(): idx for idx, name in enumerate(header_row)}
+
+    fixed = []
+    for r in data_rows:
+        r = list(r or [])
+        new_row = []
+        # نركّب صف جديد حسب EXPECTED_HEADERS
+        for col_name in EXPECTED_HEADERS:
+            idx = header_map.get(col_name)
+            if idx is not None and idx < len(r):
+                new_row.append(r[idx])
+            else:
+                new_row.append("")  # لو الكولون موش موجود في النسخة القديمة
+        fixed.append(new_row)
+
+    df = pd.DataFrame(fixed, columns=EXPECTED_HEADERS)
+    df["__sheet_name"] = title
+    return df
+
+def derive_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """المشتقات العامة لورقة وحدة (تتحسب مرّة عند التحميل وبعد كل patch).
+
+    كل الأقسام تقرا DateAjout_dt / DateSuivi_dt / Mois / MonthStr / Birth_dt…
+    من هنا، ما عادش حد يعاود pd.to_datetime. عدد التواريخ اللي احتاجت
+    fallback يتسجّل في df.attrs["date_fallback"].
+    """
+    fallback = {}
+    for col, dt_col in (
+        ("Date ajout", "DateAjout_dt"),
+        ("Date de suivi", "DateSuivi_dt"),
+        ("Date de naissance", "Birth_dt"),
+    ):
+        df[dt_col], fallback[col] = parse_dates(df[col])
+    df.attrs["date_fallback"] = fallback
+    df["Mois"] = df["DateAjout_dt"].dt.strftime("%m-%Y")
+    df["MonthStr"] = df["DateAjout_dt"].dt.strftime("%Y-%m")
+
+    today = pd.Timestamp(datetime.now().date())
+    base_alert = df["Alerte"].fillna("").astype(str).str.strip()
+    # مقارنة timestamps (NaT → False): .dt.date على عمود كلّو NaT يرجع datetime64 في pandas 3
+    dsv_day = df["DateSuivi_dt"].dt.normalize()
+    due_today = dsv_day.eq(today)
+    overdue = dsv_day.lt(today)
+
+    df["Alerte_view"] = base_alert
+    df.loc[base_alert.eq("") & overdue, "Alerte_view"] = "⚠️ متابعة متأخرة"
+    df.loc[base_alert.eq("") & due_today, "Alerte_view"] = "⏰ متابعة اليوم"
+
+    df["Téléphone_norm"] = normalize_tn_phone_series(df["Téléphone"])
+
+    df["Inscription_norm"] = (
+        df["Inscription"].fillna("").astype(str).str.strip().str.lower()
+    )
+    inscrit_mask = df["Inscription_norm"].isin(["oui", "inscrit"])
+    df.loc[inscrit_mask, "Date de suivi"] = ""
+    df.loc[inscrit_mask, "DateSuivi_dt"] = pd.NaT
+    df.loc[inscrit_mask, "Alerte_view"] = ""
+    return df
+
+def frame_mb(df: pd.DataFrame) -> float:
+    return round(float(df.memory_usage(deep=True).sum()) / 2**20, 2)
+
+def build_stats_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """جدول مجمّع: عدد لكل (MonthStr، __sheet_name، day) — الإحصائيات تولّي lookups."""
+    flags = pd.DataFrame(
+        {
+            "MonthStr": df["MonthStr"],
+            "__sheet_name": df["__sheet_name"],
+            "day": df["DateAjout_dt"].dt.normalize(),
+            "Clients": 1,
+            "Inscrits": df["Inscription_norm"].eq("oui"),
+            "Inscrits_any": df["Inscription_norm"].isin(["oui", "inscrit"]),
+            "Alerts": df["Alerte_view"].ne(""),
+        }
+    )
+    return (
+        flags.groupby(["MonthStr", "__sheet_name", "day"], dropna=False, sort=False, observed=True)
+        .sum()
+        .astype(int)
+        .reset_index()
+    )
+
+DATE_FMT = "%d/%m/%Y"  # الصيغة اللي يكتب بيها fmt_date
+
+def parse_dates(s: pd.Series) -> tuple[pd.Series, int]:
+    """(التواريخ، عدد الصفوف اللي احتاجت fallback).
+
+    نجرّبو DATE_FMT الصريح على العمود الكل (سريع)، والصفوف اللي فشلت فقط
+    (قيم قديمة بصيغ أخرى): ISO 8601 (YYYY-MM-DD) الأوّل، والباقي بـ dayfirst=True
+    (dayfirst على "2024-03-05" يقلب النهار والشهر).
+    """
+    s = s.astype(str).str.strip()
+    out = pd.to_datetime(s, format=DATE_FMT, errors="coerce")
+    need = out.isna() & s.ne("")
+    n_fallback = int(need.sum())
+    if n_fallback:
+        try:
+            out[need] = pd.to_datetime(s[need], errors="coerce", format="ISO8601")
+            need = out.isna() & s.ne("")
+            legacy = pd.to_datetime(s[need], dayfirst=True, errors="coerce", format="mixed")
+        except (TypeError, ValueError):  # pandas < 2: ISO يتعرف وحدو بلا dayfirst
+            iso = s.str.match(r"\d{4}-\d{2}-\d{2}")
+            out[need & iso] = pd.to_datetime(s[need & iso], errors="coerce")
+            need = need & ~iso
+            legacy = pd.to_datetime(s[need], dayfirst=True, errors="coerce")
+        out[need] = legacy
+    return out, n_fallback
+
+def row_from_a1(a1: str | None) -> int | None:
+    """'Ahmed'!A57:L57 → 57"""
+    if not a1:
+        return None
+    m = re.search(r"![A-Z]+(\d+)", a1)
+    return int(m.group(1)) if m else None
+
+def find_phone_row(values: list[list[str]], phone: str) -> tuple[int | None, list[str]]:
+    """(رقم الصف، قيم الصف) لأول صف فيه الهاتف، بمسح ورقة كاملة (header بالاسم)."""
+    header = values[0] if values else []
+    if "Téléphone" not in header:
+        return None, []
+    tel_idx = header.index("Téléphone")
+    for i, r in enumerate(values[1:], start=2):
+        if len(r) > tel_idx and normalize_tn_phone(r[tel_idx]) == phone:
+            return i, list(r)
+    return None, []
+
+# ============ التخزين: Google Sheets مباشرة ولا SQLite محلي + مزامنة ============
+# الواجهة وحدة للزوز: ورقة = title، الصف 1 = header، الصفوف من 2.
+class SheetsStorage:
+    """كل نداء Google Sheets يتعدّى من هنا (عبر sheets_call).
+
+    writer: لو موجود، الكتابات (append/update/delete) تمشي للـ SheetsWriter في
+    الخلفية وترجع طول؛ القراية تستنّى كان الكتابات المعلّقة على الورقة اللي تقراها.
+    """
+
+    def __init__(self, sh, writer: "SheetsWriter | None" = None, shared: "SheetsStorage | None" = None):
+        self.sh = sh
+        self.writer = writer
+        self.pending: list[int] = []  # أرقام الكتابات اللي بعثتها الجلسة هذي
+        # shared: كاش الـ worksheets والأوراق اللي تثبّتنا من الـ header متاعها (للعملية الكل)
+        self._ws: dict[str, object] = {} if shared is None else shared._ws
+        self._checked: set[str] = set() if shared is None else shared._checked
+        # آخر صف فيه داتا في العمود A لكل ورقة: (الصف، وقت القراية الكاملة)
+        self._last_rows: dict[str, tuple[int, float]] = {} if shared is None else shared._last_rows
+
+    def _submit(self, op: str, title: str, **payload):
+        counter = getattr(_api_local, "counter", None)
+        if counter is not None:  # count_api_calls: الكتابة تتحسب حتى كي تمشي للطابور
+            counter[f"queued:{op}"] += 1
+        self.pending.append(self.writer.submit(op, title, **payload))
+
+    def drain(self, titles: list[str] | None = None, row: int | None = None):
+        """نستنّاو الكتابات المعلّقة على titles (لو فمّا طابور) باش نقراو آخر حالة."""
+        if self.writer is not None:
+            self.writer.drain(titles, row)
+
+    def worksheet(self, title: str):
+        ws = self._ws.get(title)
+        if ws is None:
+            ws = self._ws[title] = sheets_call("worksheet", self.sh.worksheet, title)
+        return ws
+
+    def list_sheets(self) -> list[str]:
+        wss = sheets_call("worksheets", self.sh.worksheets)
+        self._ws.update({ws.title: ws for ws in wss})
+        return [ws.title for ws in wss]
+
+    def read_sheets(self, titles: list[str], drain: bool = True) -> dict[str, list[list[str]]]:
+        """drain=False: اللي ينادي عمل drain() قبل (مثلاً قبل ما ياخذ lock)."""
+        if drain:
+            self.drain(titles)
+        return batch_get_values(self.sh, titles)
+
+    def read_column(
+        self, titles: list[str], col: str, drain: bool = True
+    ) -> dict[str, list[list[str]]]:
+        """عمود واحد (header + قيم) من كل ورقة، في نفس طلب values_batch_get."""
+        if drain:
+            self.drain(titles)
+        return batch_get_values(self.sh, titles, f"{col}:{col}")
+
+    def write_header(self, title: str, columns: list[str]):
+        sheets_call("update", self.worksheet(title).update, "1:1", [columns])
+
+    def add_sheet(self, title: str, columns: list[str], rows: int = 1000, cols: int = 20):
+        self._ws[title] = sheets_call(
+            "add_worksheet", self.sh.add_worksheet, title=title, rows=str(rows), cols=str(cols)
+        )
+        self.write_header(title, columns)
+        self._checked.add(title)
+
+    def ensure_sheet(self, title: str, columns: list[str]):
+        """الـ header يتثبّت مرّة وحدة للعملية، موش في كل rerun."""
+        if title in self._checked:
+            return
+        try:
+            ws = self.worksheet(title)
+        except gspread.WorksheetNotFound:
+            self.add_sheet(title, columns, rows=2000, cols=max(len(columns), 8))
+            return
+        header = sheets_call("row_values", ws.row_values, 1)
+        if not header or header[: len(columns)] != columns:
+            self.write_header(title, columns)
+        self._checked.add(title)
+
+    def delete_sheet(self, title: str):
+        sheets_call("del_worksheet", self.sh.del_worksheet, self.worksheet(title))
+        self._ws.pop(title, None)
+        self._checked.discard(title)
+
+    def row_values(self, title: str, row: int) -> list[str]:
+        self.drain([title], row)
+        return sheets_call("row_values", self.worksheet(title).row_values, row)
+
+    def append_row(self, title: str, values: list) -> int | None:
+        """يرجّع رقم الصف اللي تكتب (من updatedRange)؛ None كان الكتابة في الطابور."""
+        if self.writer is not None:
+            self._submit("append_row", title, values=list(values))
+            return None
+        resp = sheets_call("append_row", self.worksheet(title).append_row, values)
+        return row_from_a1((resp or {}).get("updates", {}).get("updatedRange"))
+
+    def append_rows(self, title: str, rows: list[list]):
+        sheets_call("append_rows", self.worksheet(title).append_rows, rows)
+
+    def update_cells(self, title: str, row: int, cells: dict[int, str]):
+        """cells: {رقم العمود (1..): القيمة} في طلب batch_update واحد."""
+        if self.writer is not None:
+            self._submit("update_cells", title, row=row, cells=dict(cells))
+            return
+        self.update_ranges(title, {(row, col): v for col, v in cells.items()})
+
+    def update_ranges(self, title: str, grid: dict[tuple[int, int], str]):
+        """grid: {(صف، عمود): القيمة} — برشا صفوف في batch_update واحد."""
+        sheets_call(
+            "batch_update",
+            self.worksheet(title).batch_update,
+            [{"range": rowcol_to_a1(r, c), "values": [[v]]} for (r, c), v in grid.items()],
+            value_input_option="USER_ENTERED",
+        )
+
+    def delete_row(self, title: str, row: int):
+        if self.writer is not None:
+            self._submit("delete_row", title, row=row)
+            return
+        sheets_call("delete_rows", self.worksheet(title).delete_rows, row)
+
+    def _probe(self, title: str, lo: int, hi: int, ok) -> int:
+        """أكبر صف في [lo، hi] اللي ok(قيمة A) صحيحة فيه، على عمود مرتّب (صحيحة ثم
+        خاطئة؛ lo تتحسب صحيحة بلا قراية). كل دورة values_batch_get واحد بـ
+        COLUMN_PROBES خانة → الفترة تصغر بـ COLUMN_PROBES مرّة، كاملة في دورات قليلة."""
+        while hi > lo:
+            probes = sorted({lo + (hi - lo) * k // COLUMN_PROBES for k in range(1, COLUMN_PROBES + 1)})
+            resp = sheets_call(
+                "values_batch_get", self.sh.values_batch_get,
+                [f"{a1_sheet(title)}!A{r}" for r in probes],
+            )
+            cells = [((vr.get("values") or [[""]])[0] or [""])[0] for vr in resp.get("valueRanges", [])]
+            hits = [r for r, v in zip(probes, cells) if ok(v)]
+            if hits:
+                lo = hits[-1]
+            nxt = [r for r in probes if r > lo]
+            hi = nxt[0] - 1 if nxt else lo
+        return lo
+
+    def last_row(self, title: str) -> int:
+        """آخر صف فيه داتا في العمود A، بلا ما نمسّو الورقة ولا نقراو العمود كامل.
+
+        أول مرّة (ولا بعد SHEET_TTL): _probe على الـ grid (rowCount)؛ بعدها نقراو كان
+        من آخر صف معروف لوطة (A{last}:A) باش نلقاو الصفوف الجديدة.
+        """
+        now = time.time()
+        known = self._last_rows.get(title)
+        if known is not None and now - known[1] <= SHEET_TTL:
+            last, at = known
+            n = self._tail(title, last)
+            if n:  # الصف اللي نعرفوه مازال فيه داتا
+                self._last_rows[title] = (last - 1 + n, at)
+                return last - 1 + n
+        grid = max(self.worksheet(title).row_count, 1)
+        last = self._probe(title, 1, grid, bool)
+        if last == grid > 1:  # rowCount المكاشي قديم (appends كبّرو الـ grid)
+            last = grid - 1 + self._tail(title, grid)
+        self._last_rows[title] = (last, now)
+        return last
+
+    def _tail(self, title: str, row: int) -> int:
+        """عدد الصفوف من row لآخر خانة فيها داتا في A."""
+        resp = sheets_call("values_get", self.sh.values_get, f"{a1_sheet(title)}!A{row}:A")
+        return len(resp.get("values", []))
+
+    def first_row_from(self, title: str, prefix: str, last: int) -> int:
+        """أول صف (>= 2) اللي A متاعو >= prefix، في عمود مرتّب (السجلّ)؛ last + 1 لو ما فماش."""
+        return self._probe(title, 1, last, lambda v: v[: len(prefix)] < prefix) + 1
+
+    def read_rows(self, title: str, first: int, last: int) -> list[list[str]]:
+        """الصفوف first..last (first >= 2) في قراية محدودة وحدة."""
+        resp = sheets_call("values_get", self.sh.values_get, f"{a1_sheet(title)}!{first}:{last}")
+        return resp.get("values", [])
+
+    def move_row(
+        self, src: str, row: int, dst: str, values: list,
+        log_title: str | None = None, log_values: list | None = None,
+    ):
+        """نقل صف في طلب spreadsheet.batch_update واحد (atomic):
+        appendCells في dst + deleteDimension في src (+ appendCells في السجلّ).
+        """
+        # أرقام الصفوف لازم تكون نهائية في الأوراق اللي يمسّهم الطلب
+        self.drain([src, dst] + ([log_title] if log_title else []))
+
+        def append(title, vals):
+            cells = [{"userEnteredValue": {"stringValue": str(v)}} for v in vals]
+            return {
+                "appendCells": {
+                    "sheetId": self.worksheet(title).id,
+                    "rows": [{"values": cells}],
+                    "fields": "userEnteredValue",
+                }
+            }
+
+        requests = [
+            append(dst, values),
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": self.worksheet(src).id,
+                        "dimension": "ROWS",
+                        "startIndex": row - 1,
+                        "endIndex": row,
+                    }
+                }
+            },
+        ]
+        if log_title:
+            requests.append(append(log_title, log_values))
+        sheets_call("move_row", self.sh.batch_update, {"requests": requests})
+
+# ============ طابور الكتابة في الخلفية (Google Sheets) ============
+WRITE_QUEUE_MAX = 500  # أقصى كتابات معلّقة؛ بعدها submit يستنّى (backpressure)
+WRITE_FLUSH_SIZE = 50  # نفلوشو كي يتجمّعو هالقدّ
+WRITE_FLUSH_SECS = 1.0  # ولا بعد هالمدّة من أول كتابة
+WRITE_STATUS_KEEP = 1000  # نتايج منتهية نخلّيوهم للجلسات اللي ما شافتهمش (بعدها تتنحّى)
+
+class SheetsWriter:
+    """thread وحيد للعملية يكتب في Google Sheets.
+
+    الكتابات المتتالية تتجمّع: update_cells على نفس الورقة → batch_update واحد
+    (آخر قيمة تربح لكل خانة)، append_row → append_rows واحد. delete_row يسكّر
+    الدفعة خاطر يبدّل أرقام الصفوف. status: رقم الكتابة → queued/done/failed،
+    المنتهية تتنحّى كي الجلسة تقراها (take_status) ولا كي يفوتو WRITE_STATUS_KEEP.
+    inflight: (ورقة، op، صف) → عدد الكتابات اللي ما تكتبتش، باش drain يستنّى كان
+    الورقة اللي باش تتقرا.
+    """
+
+    def __init__(self, remote: SheetsStorage, store: "SheetStore"):
+        self.remote = remote
+        self.store = store
+        self.queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_MAX)
+        self.status: dict[int, str] = {}
+        self.status_lock = threading.Lock()
+        self.inflight = Counter()
+        self.cond = threading.Condition()
+        self._ids = itertools.count(1)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, op: str, title: str, **payload) -> int:
+        wid = next(self._ids)
+        with self.status_lock:
+            self.status[wid] = "queued"
+        with self.cond:
+            self.inflight[(title.strip(), op, payload.get("row"))] += 1
+        self.queue.put((wid, op, title, payload), timeout=30)
+        return wid
+
+    def take_status(self, wids: list[int]) -> dict[int, str]:
+        """حالة wids؛ اللي كملت (done/failed) تتنحّى من status بعد ما تتقرا."""
+        with self.status_lock:
+            out = {w: self.status.get(w, "done") for w in wids}
+            for w, state in out.items():
+                if state != "queued":
+                    self.status.pop(w, None)
+        return out
+
+    def _busy(self, titles: set[str] | None, row: int | None) -> bool:
+        return any(
+            (titles is None or t in titles) and (row is None or op != "update_cells" or r == row)
+            for t, op, r in self.inflight
+        )
+
+    def drain(self, titles: list[str] | None = None, row: int | None = None, timeout: float = 30.0):
+        """نستنّاو الكتابات اللي تمسّ titles (None = الطابور الكل) قبل ما نقراوهم.
+
+        row: قراية صف واحد — تعديلات صفوف أخرى ما تبدّلوش؛ append/delete ايه (الأرقام).
+        """
+        titles = None if titles is None else {t.strip() for t in titles}
+        with self.cond:
+            self.cond.wait_for(lambda: not self._busy(titles, row), timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + WRITE_FLUSH_SECS
+            while len(batch) < WRITE_FLUSH_SIZE and batch[-1][1] != "delete_row":
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            finally:
+                with self.cond:
+                    for _, op, title, p in batch:
+                        key = (title.strip(), op, p.get("row"))
+                        self.inflight[key] -= 1
+                        if self.inflight[key] <= 0:
+                            del self.inflight[key]
+                    self.cond.notify_all()
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _flush(self, batch):
+        appends: dict[str, list] = {}
+        grids: dict[str, dict] = {}
+        ids: dict[str, list[int]] = {}
+        deletes = []
+        for wid, op, title, p in batch:
+            ids.setdefault(title, []).append(wid)
+            if op == "append_row":
+                appends.setdefault(title, []).append(p["values"])
+            elif op == "update_cells":
+                grid = grids.setdefault(title, {})
+                for col, v in p["cells"].items():
+                    grid[(p["row"], col)] = v
+            else:
+                deletes.append((title, p["row"]))
+        # appends قبل updates: تعديل صف تزاد في نفس الدفعة يلقاه في بلاصتو
+        jobs = [(t, self.remote.append_rows, t, rows) for t, rows in appends.items()]
+        jobs += [(t, self.remote.update_ranges, t, g) for t, g in grids.items()]
+        jobs += [(t, self.remote.delete_row, t, r) for t, r in deletes]
+        failed = {}
+        for title, fn, *args in jobs:
+            if title in failed:
+                continue
+            try:
+                fn(*args)  # المعاودة على 429/5xx في sheets_call
+            except Exception as e:
+                failed[title] = str(e)
+                # الكاش سبق الورقة → نعاودو نقراوها (بلا lock: load ينجم يكون يستنّى فينا)
+                self.store.invalidate_later(title.strip())
+        with self.status_lock:
+            for title, wids in ids.items():
+                for wid in wids:
+                    self.status[wid] = f"failed: {failed[title]}" if title in failed else "done"
+            extra = len(self.status) - WRITE_STATUS_KEEP
+            if extra > 0:  # جلسات سكّرت قبل ما تشوف النتيجة
+                old = [w for w, state in self.status.items() if state != "queued"][:extra]
+                for w in old:
+                    del self.status[w]
+
+def _iso_date(val: str) -> str | None:
+    try:
+        return datetime.strptime(str(val).strip(), DATE_FMT).date().isoformat()
+    except ValueError:
+        return None
+
+class SqliteStorage:
+    """التخزين الأساسي المحلي: نفس واجهة SheetsStorage، قراية بـ queries مفهرسة.
+
+    كل كتابة تتسجّل زادة في outbox باش SheetsSync يعاودها على Google Sheets.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sheets (
+        title    TEXT PRIMARY KEY,
+        headers  TEXT NOT NULL,
+        position INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rows (
+        sheet      TEXT NOT NULL,
+        row_no     INTEGER NOT NULL,
+        vals       TEXT NOT NULL,
+        phone      TEXT,
+        employe    TEXT,
+        date_ajout TEXT,
+        date_suivi TEXT,
+        PRIMARY KEY (sheet, row_no)
+    );
+    CREATE INDEX IF NOT EXISTS rows_phone ON rows (phone);
+    CREATE INDEX IF NOT EXISTS rows_employe ON rows (employe);
+    CREATE INDEX IF NOT EXISTS rows_date_ajout ON rows (date_ajout);
+    CREATE INDEX IF NOT EXISTS rows_date_suivi ON rows (date_suivi);
+    CREATE TABLE IF NOT EXISTS outbox (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        op      TEXT NOT NULL,
+        sheet   TEXT NOT NULL,
+        payload TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+    # ---------- داخلي ----------
+    def _headers(self, title: str) -> list[str] | None:
+        row = self.conn.execute("SELECT headers FROM sheets WHERE title=?", (title,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _row_meta(self, headers: list[str], values: list) -> tuple:
+        def col(name):
+            i = headers.index(name) if name in headers else -1
+            return str(values[i]) if 0 <= i < len(values) else ""
+        return (
+            normalize_tn_phone(col("Téléphone")) or None,
+            col("Employe") or None,
+            _iso_date(col("Date ajout")),
+            _iso_date(col("Date de suivi")),
+        )
+
+    def _put_row(self, title: str, row: int, values: list, headers: list[str]):
+        values = ["" if v is None else str(v) for v in values]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO rows VALUES (?,?,?,?,?,?,?)",
+            (title, row, json.dumps(values, ensure_ascii=False), *self._row_meta(headers, values)),
+        )
+
+    def _outbox(self, op: str, title: str, **payload):
+        self.conn.execute(
+            "INSERT INTO outbox (op, sheet, payload) VALUES (?,?,?)",
+            (op, title, json.dumps(payload, ensure_ascii=False)),
+        )
+
+    def _delete(self, title: str, row: int):
+        self.conn.execute("DELETE FROM rows WHERE sheet=? AND row_no=?", (title, row))
+        # نزيحو الصفوف اللي تحتو بخطوتين باش ما يصيرش تصادم في المفتاح
+        self.conn.execute(
+            "UPDATE rows SET row_no = -(row_no - 1) WHERE sheet=? AND row_no>?", (title, row)
+        )
+        self.conn.execute("UPDATE rows SET row_no = -row_no WHERE sheet=? AND row_no<0", (title,))
+
+    def _append(self, title: str, values: list) -> int:
+        headers = self._require(title)
+        row = self.conn.execute(
+            "SELECT COALESCE(MAX(row_no), 1) + 1 FROM rows WHERE sheet=?", (title,)
+        ).fetchone()[0]
+        self._put_row(title, row, list(values), headers)
+        return row
+
+    def _require(self, title: str) -> list[str]:
+        headers = self._headers(title)
+        if headers is None:
+            raise gspread.WorksheetNotFound(title)
+        return headers
+
+    # ---------- نفس واجهة SheetsStorage ----------
+    def list_sheets(self) -> list[str]:
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT title FROM sheets ORDER BY position")]
+
+    def drain(self, titles: list[str] | None = None, row: int | None = None):
+        pass  # الكتابات في SQLite متزامنة
+
+    def read_sheets(self, titles: list[str], drain: bool = True) -> dict[str, list[list[str]]]:
+        out = {}
+        with self.lock:
+            for t in titles:
+                headers = self._headers(t) or []
+                rows = [
+                    json.loads(v)
+                    for (v,) in self.conn.execute(
+                        "SELECT vals FROM rows WHERE sheet=? ORDER BY row_no", (t,)
+                    )
+                ]
+                out[t] = ([headers] + rows) if (headers or rows) else []
+        return out
+
+    def read_column(
+        self, titles: list[str], col: str, drain: bool = True
+    ) -> dict[str, list[list[str]]]:
+        idx = a1_to_rowcol(f"{col}1")[1] - 1
+        return {
+            t: [r[idx : idx + 1] for r in rows]
+            for t, rows in self.read_sheets(titles).items()
+        }
+
+    def write_header(self, title: str, columns: list[str]):
+        with self.lock, self.conn:
+            self._require(title)
+            self.conn.execute(
+                "UPDATE sheets SET headers=? WHERE title=?",
+                (json.dumps(list(columns), ensure_ascii=False), title),
+            )
+            self._outbox("write_header", title, columns=list(columns))
+
+    def add_sheet(self, title: str, columns: list[str], rows: int = 1000, cols: int = 20):
+        with self.lock, self.conn:
+            pos = self.conn.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM sheets").fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO sheets VALUES (?,?,?)",
+                (title, json.dumps(list(columns), ensure_ascii=False), pos),
+            )
+            self._outbox("add_sheet", title, columns=list(columns), rows=rows, cols=cols)
+
+    def ensure_sheet(self, title: str, columns: list[str]):
+        with self.lock:
+            header = self._headers(title)
+            if header is None:
+                self.add_sheet(title, columns, rows=2000, cols=max(len(columns), 8))
+            elif not header or header[: len(columns)] != columns:
+                self.write_header(title, columns)
+
+    def delete_sheet(self, title: str):
+        with self.lock, self.conn:
+            self._require(title)
+            self.conn.execute("DELETE FROM rows WHERE sheet=?", (title,))
+            self.conn.execute("DELETE FROM sheets WHERE title=?", (title,))
+            self._outbox("delete_sheet", title)
+
+    def row_values(self, title: str, row: int) -> list[str]:
+        with self.lock:
+            r = self.conn.execute(
+                "SELECT vals FROM rows WHERE sheet=? AND row_no=?", (title, row)
+            ).fetchone()
+        return json.loads(r[0]) if r else []
+
+    def append_row(self, title: str, values: list) -> int | None:
+        with self.lock, self.conn:
+            row = self._append(title, values)
+            self._outbox("append_row", title, values=list(values))
+        return row
+
+    def _row_phone(self, title: str, row: int) -> str | None:
+        """الهاتف (منظّف) اللي في الصف توّا: يتسجّل في الـ outbox باش push يتأكّد منو."""
+        r = self.conn.execute(
+            "SELECT phone FROM rows WHERE sheet=? AND row_no=?", (title, row)
+        ).fetchone()
+        return r[0] if r else None
+
+    def update_cells(self, title: str, row: int, cells: dict[int, str]):
+        with self.lock, self.conn:
+            headers = self._require(title)
+            values = self.row_values(title, row)
+            if not values:
+                raise IndexError(f"{title}: الصف {row} موش موجود")
+            width = max([len(values)] + list(cells))
+            values += [""] * (width - len(values))
+            for col, v in cells.items():
+                values[col - 1] = v
+            phone = self._row_phone(title, row)
+            self._put_row(title, row, values, headers)
+            self._outbox(
+                "update_cells", title, row=row, phone=phone,
+                cells={str(c): v for c, v in cells.items()},
+            )
+
+    def delete_row(self, title: str, row: int):
+        with self.lock, self.conn:
+            self._require(title)
+            phone = self._row_phone(title, row)
+            self._delete(title, row)
+            self._outbox("delete_row", title, row=row, phone=phone)
+
+    def move_row(
+        self, src: str, row: int, dst: str, values: list,
+        log_title: str | None = None, log_values: list | None = None,
+    ):
+        """نفس move_row متاع SheetsStorage: transaction وحدة وعملية وحدة في الـ outbox."""
+        with self.lock, self.conn:
+            self._require(src)
+            phone = self._row_phone(src, row)
+            self._append(dst, values)
+            self._delete(src, row)
+            if log_title:
+                self._append(log_title, log_values)
+            self._outbox(
+                "move_row", src, row=row, phone=phone, dst=dst, values=list(values),
+                log_title=log_title, log_values=log_values,
+            )
+
+    def last_row(self, title: str) -> int:
+        with self.lock:
+            self._require(title)
+            return self.conn.execute(
+                "SELECT COALESCE(MAX(row_no), 1) FROM rows WHERE sheet=?", (title,)
+            ).fetchone()[0]
+
+    def first_row_from(self, title: str, prefix: str, last: int) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COALESCE(MIN(row_no), ?) FROM rows WHERE sheet=? AND row_no BETWEEN 2 AND ?"
+                " AND substr(json_extract(vals, '$[0]'), 1, ?) >= ?",
+                (last + 1, title, last, len(prefix), prefix),
+            ).fetchone()[0]
+
+    def read_rows(self, title: str, first: int, last: int) -> list[list[str]]:
+        with self.lock:
+            return [
+                json.loads(v)
+                for (v,) in self.conn.execute(
+                    "SELECT vals FROM rows WHERE sheet=? AND row_no BETWEEN ? AND ? ORDER BY row_no",
+                    (title, first, last),
+                )
+            ]
+
+    # ---------- للمزامنة ----------
+    def phone_locations(self, phone: str) -> list[tuple[str, int]]:
+        with self.lock:
+            return list(self.conn.execute("SELECT sheet, row_no FROM rows WHERE phone=?", (phone,)))
+
+    def replace_sheet(self, title: str, rows: list[list[str]]) -> bool:
+        """نسخة Google Sheets تعوّض النسخة المحلية (بلا outbox). يرجّع True كان تبدّلت.
+
+        كتابة محلية صارت وقت القراية من Google Sheets → الورقة dirty → ما نمسّوهاش.
+        """
+        with self.lock:
+            if title in self.dirty_sheets() or self.read_sheets([title])[title] == rows:
+                return False
+            with self.conn:
+                headers = rows[0] if rows else []
+                if self._headers(title) is None:
+                    pos = self.conn.execute(
+                        "SELECT COALESCE(MAX(position), 0) + 1 FROM sheets"
+                    ).fetchone()[0]
+                    self.conn.execute(
+                        "INSERT INTO sheets VALUES (?,?,?)",
+                        (title, json.dumps(headers, ensure_ascii=False), pos),
+                    )
+                else:
+                    self.conn.execute(
+                        "UPDATE sheets SET headers=? WHERE title=?",
+                        (json.dumps(headers, ensure_ascii=False), title),
+                    )
+                self.conn.execute("DELETE FROM rows WHERE sheet=?", (title,))
+                for i, r in enumerate(rows[1:], start=2):
+                    self._put_row(title, i, r, headers)
+            return True
+
+    def drop_sheet(self, title: str) -> bool:
+        with self.lock, self.conn:
+            if title in self.dirty_sheets():
+                return False
+            self.conn.execute("DELETE FROM rows WHERE sheet=?", (title,))
+            self.conn.execute("DELETE FROM sheets WHERE title=?", (title,))
+            return True
+
+    def outbox_items(self, limit: int = 200) -> list[tuple[int, str, str, dict]]:
+        with self.lock:
+            return [
+                (i, op, sheet, json.loads(payload))
+                for i, op, sheet, payload in self.conn.execute(
+                    "SELECT id, op, sheet, payload FROM outbox ORDER BY id LIMIT ?", (limit,)
+                )
+            ]
+
+    def ack(self, op_id: int):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM outbox WHERE id=?", (op_id,))
+
+    def dirty_sheets(self) -> set[str]:
+        out = set()
+        with self.lock:
+            for sheet, op, payload in self.conn.execute("SELECT sheet, op, payload FROM outbox"):
+                out.add(sheet)
+                if op == "move_row":
+                    p = json.loads(payload)
+                    out.update(t for t in (p["dst"], p["log_title"]) if t)
+        return out
+
+class SheetsSync:
+    """مرآة بين SQLite (الأساس) و Google Sheets.
+
+    push: يعاود الـ outbox بالترتيب على Google Sheets. أرقام الصفوف تسجّلت محلياً
+    والورقة تتبدّل مباشرة، فقبل أي update/delete/move نتأكّدو من الهاتف في الصف.
+    pull: يجيب أوراق الـ CRM (موظّفين، أرشيف، سجلّ النقل) اللي ما عندهاش كتابات
+    محلية معلّقة ويبطّل الكاش متاعها. أوراق أخرى (مثلاً _PAIEMENTS) ما تتنسخش.
+    """
+
+    def __init__(self, local: SqliteStorage, remote: SheetsStorage, store: "SheetStore"):
+        self.local = local
+        self.remote = remote
+        self.store = store
+        self.last_pull = 0.0
+        self.last_error: str | None = None
+        self.skipped = Counter()  # op → عمليات تطيّحت (العميل ما عادش في الورقة)
+        self._wake = threading.Event()
+
+    def _confirm_row(self, title: str, row: int, phone: str | None) -> int | None:
+        """الصف اللي فيه phone في Google Sheets: row لو يطابق، وإلا ندوّرو في الورقة."""
+        if not phone:  # عمليات قديمة بلا هاتف في الـ payload
+            return row
+        vals = self.remote.row_values(title, row)
+        if len(vals) > TEL_COL and normalize_tn_phone(vals[TEL_COL]) == phone:
+            return row
+        return find_phone_row(self.remote.read_sheets([title]).get(title, []), phone)[0]
+
+    def push(self) -> int:
+        done = 0
+        for op_id, op, title, p in self.local.outbox_items():
+            row = None
+            if op in ("update_cells", "delete_row", "move_row"):
+                row = self._confirm_row(title, p["row"], p.get("phone"))
+                if row is None:
+                    # تنحّى ولا تبدّل الهاتف في Google Sheets: ما نكتبوش على عميل آخر
+                    self.skipped[op] += 1
+                    self.local.ack(op_id)
+                    continue
+            if op == "append_row":
+                self.remote.append_row(title, p["values"])
+            elif op == "update_cells":
+                self.remote.update_cells(title, row, {int(c): v for c, v in p["cells"].items()})
+            elif op == "delete_row":
+                self.remote.delete_row(title, row)
+            elif op == "move_row":
+                self.remote.move_row(
+                    title, row, p["dst"], p["values"], p["log_title"], p["log_values"]
+                )
+            elif op == "write_header":
+                self.remote.write_header(title, p["columns"])
+            elif op == "add_sheet":
+                self.remote.add_sheet(title, p["columns"], rows=p["rows"], cols=p["cols"])
+            elif op == "delete_sheet":
+                self.remote.delete_sheet(title)
+            self.local.ack(op_id)
+            done += 1
+        return done
+
+    @staticmethod
+    def is_mirrored(title: str) -> bool:
+        t = title.strip()
+        return is_employee_sheet(t) or t.endswith(ARCHIVE_SUFFIX) or t == REASSIGN_LOG_SHEET
+
+    def pull(self):
+        titles = [t for t in self.remote.list_sheets() if self.is_mirrored(t)]
+        dirty = self.local.dirty_sheets()
+        clean = [t for t in titles if t not in dirty]
+        values = self.remote.read_sheets(clean)
+        changed = [t for t in clean if self.local.replace_sheet(t, values.get(t, []))]
+        for t in set(self.local.list_sheets()) - set(titles) - dirty:
+            if self.local.drop_sheet(t):
+                changed.append(t)
+        if changed:
+            self.store.invalidate(*[t.strip() for t in changed])
+            self.store.invalidate_sheets()
+        self.last_pull = time.time()
+
+    def notify(self):
+        """بعد كل كتابة محلية: نفيّقو الـ thread باش يعمل push."""
+        self._wake.set()
+
+    def run_forever(self, interval: float = 5.0):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.push()
+                if time.time() - self.last_pull > SHEET_TTL:
+                    self.pull()
+                self.last_error = None
+            except Exception as e:  # نعاودو في الدورة الجاية
+                self.last_error = str(e)
+
+SHEET_TTL = 600  # ثواني قبل ما نعاودو نقراو ورقة من Google Sheets
+TEL_COL = EXPECTED_HEADERS.index("Téléphone")
+TEL_LETTER = rowcol_to_a1(1, TEL_COL + 1)[:-1]  # "B"
+
+class SheetStore:
+    """كاش مشترك بين الجلسات: DataFrame لكل ورقة، يتبطل ورقة بورقة بعد كل كتابة.
+
+    phone_index: هاتف منظّف → (الورقة، رقم الصف) محدّث مع كل تحميل/إضافة/حذف.
+    أوراق الأرشيف ديما فيه (من عمود الهاتف)، حتى كان تبويب الأرشيف ما تحلّش.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.frames: dict[str, tuple[float, pd.DataFrame]] = {}
+        self.sheets: list[tuple[str, str]] | None = None  # (العنوان الخام، العنوان المنظّف)
+        self.archives: list[tuple[str, str]] = []  # أوراق *_Archive، من نفس list_sheets
+        self.sheets_at = 0.0
+        self.version = 0
+        self.derived_on = None  # Alerte_view تتبدّل مع النهار
+        self._cube = None  # (version، cube عام = cubes الأوراق ملصوقين)
+        # ورقة → (الـ frame اللي تبنى منو ولا None، وقت البناء، cube): None = الـ frame
+        # ما تخلّاش (global_cube في وضع الموظّف)، الـ cube يعيش SHEET_TTL
+        self._sheet_cubes: dict[str, tuple[pd.DataFrame | None, float, pd.DataFrame]] = {}
+        self._client_idx: dict[str, tuple[pd.DataFrame, tuple]] = {}
+        self.rows: dict[str, dict[str, int]] = {}  # ورقة → {هاتف: صف}
+        self.phone_index: dict[str, tuple[str, int]] = {}
+        self.phones_at: dict[str, float] = {}  # أوراق مفهرسة من عمود الهاتف برك (بلا frame)
+        self.date_fallbacks: dict[str, int] = {}  # ورقة → تواريخ بصيغة قديمة
+        self.cache_stats = Counter()  # sheet_hit/sheet_miss/phones_miss
+        self.track_memory = PROFILER is not None  # memory_usage(deep) موش ببلاش
+        self.mem_report: dict[str, float] = {}  # المرحلة → MB
+        self._stale: set[str] = set()  # invalidate_later: تتطبّق في أول load/frame
+
+    def invalidate_later(self, *titles: str):
+        """من thread الكتابة: بلا self.lock (الـ loads يعملو drain)، تتطبّق في أول قراية."""
+        self._stale.update(titles)
+
+    def _apply_stale(self):
+        while self._stale:
+            self.invalidate(self._stale.pop())
+
+    def _fresh(self, title: str, now: float) -> bool:
+        return title in self.frames and now - self.frames[title][0] <= SHEET_TTL
+
+    def _drain_for(self, storage, needs_read):
+        """needs_read() → العناوين الخام اللي باش تتقرا: الكتابات المعلّقة عليهم برك
+        تتكتب قبل، وبرّا self.lock: طابور يستنّى (429) ما يوقّفش الـ loads متاع
+        الجلسات الأخرى. الكاش صالح → ما نستنّاو شي."""
+        with self.lock:
+            self._apply_stale()
+            titles = needs_read()
+        if titles:
+            storage.drain(titles)
+
+    def invalidate(self, *titles: str):
+        with self.lock:
+            for t in titles:
+                self.frames.pop(t, None)
+                self.phones_at.pop(t, None)
+                self._sheet_cubes.pop(t, None)
+                self._unindex(t)
+            self.version += 1
+
+    def invalidate_sheets(self):
+        """بعد إضافة/حذف ورقة: نعاودو نقراو قائمة الأوراق."""
+        with self.lock:
+            self.sheets = None
+            self.version += 1
+
+    def invalidate_all(self):
+        """بعد مزامنة كاملة: كل شي يتعاود يتقرا."""
+        with self.lock:
+            self.invalidate(*set(self.frames) | set(self.phones_at))
+            self.invalidate_sheets()
+
+    def employee_titles(self, storage) -> list[str]:
+        """أسماء أوراق الموظّفين (قائمة مكاشية) بلا ما نقراو حتى ورقة."""
+        with self.lock:
+            return [t for _, t in self._employee_sheets(storage)]
+
+    def _employee_sheets(self, storage) -> list[tuple[str, str]]:
+        now = time.time()
+        if self.sheets is None or now - self.sheets_at > SHEET_TTL:
+            titles = [(t, t.strip()) for t in storage.list_sheets()]
+            self.sheets = [(raw, t) for raw, t in titles if is_employee_sheet(t)]
+            self.archives = [(raw, t) for raw, t in titles if t.endswith(ARCHIVE_SUFFIX)]
+            self.sheets_at = now
+        return self.sheets
+
+    def _phones_stale(self, pairs: list[tuple[str, str]], now: float) -> list[tuple[str, str]]:
+        """أوراق بلا frame صالح وفهرس الهاتف متاعها قديم."""
+        return [
+            (raw, t)
+            for raw, t in pairs
+            if not self._fresh(t, now) and now - self.phones_at.get(t, -SHEET_TTL - 1) > SHEET_TTL
+        ]
+
+    def _read_phones(self, storage, pairs: list[tuple[str, str]], now: float) -> list[tuple[str, str]]:
+        """عمود الهاتف برك → phone_index، في طلب واحد.
+
+        يرجّع الأوراق اللي الهاتف موش في عمودو (ترتيب قديم): تتقرا كاملة.
+        """
+        if not pairs:
+            return []
+        self.cache_stats["phones_miss"] += len(pairs)
+        cols = storage.read_column([raw for raw, _ in pairs], TEL_LETTER, drain=False)
+        full = []
+        for raw, title in pairs:
+            col = cols.get(raw, [])
+            if col and (col[0] or [""])[0].strip() != "Téléphone":
+                full.append((raw, title))  # rows_to_frame يلقى الهاتف بالاسم
+                continue
+            if self.frames.pop(title, None) is not None:  # frame قديم ما عادش يطابق الفهرس
+                self.version += 1
+            self._index(title, [normalize_tn_phone((r or [""])[0]) for r in col[1:]])
+            self.phones_at[title] = now
+        return full
+
+    # ---------- فهرس الهواتف ----------
+    def _unindex(self, title: str):
+        for ph in self.rows.pop(title, {}):
+            if self.phone_index.get(ph, ("",))[0] == title:
+                del self.phone_index[ph]
+
+    def _index(self, title: str, phones: list[str] | None = None):
+        """phones: أرقام منظّفة بترتيب الصفوف؛ None → من الـ frame المكاشي."""
+        self._unindex(title)
+        if phones is None:
+            phones = self.frames[title][1]["Téléphone_norm"].tolist()
+        # أول ظهور يربح (كيف المسح القديم)
+        rows = {}
+        for row, ph in enumerate(phones, start=2):
+            if ph and ph not in rows:
+                rows[ph] = row
+        self.rows[title] = rows
+        for ph, row in rows.items():
+            self.phone_index.setdefault(ph, (title, row))
+
+    def _set_frame(self, title: str, loaded_at: float, df: pd.DataFrame):
+        self.frames[title] = (loaded_at, df)
+        self.date_fallbacks[title] = sum(df.attrs.get("date_fallback", {}).values())
+        self._index(title)
+
+    def locate(self, phone: str) -> tuple[str, int] | None:
+        return self.phone_index.get(phone)
+
+    def sheet_row(self, title: str, phone: str) -> int | None:
+        """رقم الصف في الورقة (1 = header) حسب الكاش."""
+        return self.rows.get(title, {}).get(phone)
+
+    def _read_frames(self, storage, pairs: list[tuple[str, str]], now: float):
+        """pairs: (العنوان الخام، العنوان المنظّف) → frames كاملة في طلب واحد."""
+        if not pairs:
+            return
+        values = storage.read_sheets([raw for raw, _ in pairs], drain=False)
+        for raw, title in pairs:
+            rows = values.get(raw, [])
+            if not rows:
+                # لو الورقة فارغة، نعمل header بالصيغة الجديدة
+                storage.write_header(raw, EXPECTED_HEADERS)
+                rows = [EXPECTED_HEADERS]
+            self._set_frame(title, now, derive_columns(rows_to_frame(title, rows)))
+        self.version += 1
+
+    def _rederive_if_new_day(self):
+        today = datetime.now().date()
+        if self.derived_on != today:
+            if self.derived_on is not None:
+                for t, (at, df) in list(self.frames.items()):
+                    self.frames[t] = (at, derive_columns(df.copy()))
+                # cubes بلا frame: التنبيهات تبدّلت، يتعاودو يتبناو
+                self._sheet_cubes = {t: c for t, c in self._sheet_cubes.items() if c[0] is not None}
+                self.version += 1
+            self.derived_on = today
+
+    def _employee_plan(self, storage, employee: str):
+        """(الأوراق، ورقة الموظّف لو لازم تتقرا، أوراق لازم يتقرا عمود الهاتف متاعها)."""
+        sheets = self._employee_sheets(storage)
+        now = time.time()
+        own = [(raw, t) for raw, t in sheets if t == employee and not self._fresh(t, now)]
+        others = self._phones_stale(
+            [(raw, t) for raw, t in sheets if t != employee] + self.archives, now
+        )
+        return sheets, own, others
+
+    def load_employee(self, storage, employee: str) -> tuple[pd.DataFrame, list[str]]:
+        """وضع الموظّف: ورقتو كاملة + عمود الهاتف برك من بقية الأوراق.
+
+        phone_index يبقى عام (duplicate check) وأوراق الآخرين كاملة ما يتقراوش؛
+        يتخلّاو للأدمِن (load).
+        """
+        def needs_read():
+            _, own, others = self._employee_plan(storage, employee)
+            return [raw for raw, _ in own + others]
+
+        self._drain_for(storage, needs_read)
+        with self.lock:
+            self._apply_stale()
+            sheets, own, others = self._employee_plan(storage, employee)
+            now = time.time()
+            self.cache_stats["sheet_miss"] += len(own)
+            self._read_frames(storage, own + self._read_phones(storage, others, now), now)
+            self._rederive_if_new_day()
+            df = self.frames[employee][1] if employee in self.frames else derive_columns(
+                rows_to_frame(employee, [EXPECTED_HEADERS])
+            )
+            return df, [t for _, t in sheets]
+
+    def load(self, storage) -> list[str]:
+        """كل أوراق الموظّفين في الكاش (frame لكل ورقة، بلا frame مجمّع) → أسماءهم.
+
+        الإحصائيات من cubes الأوراق (stats_cube)؛ الأرشيف عمود الهاتف برك.
+        """
+        def needs_read():
+            now = time.time()
+            sheets = self._employee_sheets(storage)
+            stale = [raw for raw, t in sheets if not self._fresh(t, now)]
+            return stale + [raw for raw, _ in self._phones_stale(self.archives, now)]
+
+        self._drain_for(storage, needs_read)
+        with self.lock:
+            self._apply_stale()
+            sheets = self._employee_sheets(storage)
+            now = time.time()
+            stale = [(raw, title) for raw, title in sheets if not self._fresh(title, now)]
+            self.cache_stats["sheet_hit"] += len(sheets) - len(stale)
+            self.cache_stats["sheet_miss"] += len(stale)
+            self._read_frames(storage, stale, now)
+            # الأرشيف: عمود الهاتف برك (duplicate check)، الـ frame يتقرا في تبويبو
+            self._read_frames(
+                storage, self._read_phones(storage, self._phones_stale(self.archives, now), now), now
+            )
+            self._rederive_if_new_day()
+
+            if self.track_memory and (stale or "sheet frames" not in self.mem_report):
+                self.mem_report["sheet frames"] = round(
+                    sum(frame_mb(self.frames[t][1]) for _, t in sheets), 2
+                )
+            return [title for _, title in sheets]
+
+    def frame(self, storage, title: str) -> pd.DataFrame:
+        """ورقة وحدة في نفس الكاش تتقرا كان وقت نحتاجوها (الأرشيف، أو موظّف آخر في وضع الموظّف)."""
+        self._drain_for(storage, lambda: [] if self._fresh(title, time.time()) else [title])
+        with self.lock:
+            self._apply_stale()
+            now = time.time()
+            if not self._fresh(title, now):
+                raw = {t: r for r, t in self.sheets or []}.get(title, title)
+                rows = storage.read_sheets([raw], drain=False).get(raw, []) or [EXPECTED_HEADERS]
+                self._set_frame(title, now, derive_columns(rows_to_frame(title, rows)))
+                self.version += 1
+            return self.frames[title][1]
+
+    def _cube_fresh(self, title: str, now: float) -> bool:
+        if self._fresh(title, now):
+            return True
+        cached = self._sheet_cubes.get(title)
+        return title not in self.frames and cached is not None and now - cached[1] <= SHEET_TTL
+
+    def _sheet_cube(self, title: str) -> pd.DataFrame:
+        """cube ورقة: من الـ frame (يتعاود كان الـ frame تبدّل) ولا المخزون بلا frame."""
+        entry = self.frames.get(title)
+        if entry is None:
+            cached = self._sheet_cubes.get(title)
+            if cached is None:  # ورقة موش موجودة
+                return build_stats_cube(derive_columns(rows_to_frame(title, [EXPECTED_HEADERS])))
+            return cached[2]
+        cached = self._sheet_cubes.get(title)
+        if cached is None or cached[0] is not entry[1]:
+            cached = self._sheet_cubes[title] = (entry[1], time.time(), build_stats_cube(entry[1]))
+        return cached[2]
+
+    def global_cube(self, storage) -> pd.DataFrame:
+        """cube كل الموظّفين بلا ما نحمّلو الـ frames في وضع الموظّف.
+
+        ورقة بلا frame صالح ولا cube صالح تتقرا كاملة (طلب واحد للكل): الـ cube
+        والفهرس متاع الهاتف يتخلّاو، الـ frame يتلوح. الكاش مشترك بين الجلسات.
+        """
+        def needs_read():
+            now = time.time()
+            return [raw for raw, t in self._employee_sheets(storage) if not self._cube_fresh(t, now)]
+
+        self._drain_for(storage, needs_read)
+        with self.lock:
+            self._apply_stale()
+            self._rederive_if_new_day()
+            now = time.time()
+            stale = [(raw, t) for raw, t in self._employee_sheets(storage) if not self._cube_fresh(t, now)]
+            values = storage.read_sheets([raw for raw, _ in stale], drain=False) if stale else {}
+            for raw, title in stale:
+                df = derive_columns(rows_to_frame(title, values.get(raw) or [EXPECTED_HEADERS]))
+                if title in self.frames:  # frame قديم في الكاش: نبدّلوه
+                    self._set_frame(title, now, df)
+                    continue
+                self._index(title, df["Téléphone_norm"].tolist())
+                self.phones_at[title] = now
+                self._sheet_cubes[title] = (None, now, build_stats_cube(df))
+            if stale:
+                self.version += 1
+            return self.stats_cube()
+
+    def stats_cube(self, title: str | None = None) -> pd.DataFrame:
+        """cube ورقة وحدة (title) ولا عام: cubes الأوراق ملصوقين، يتبنى مرّة لكل نسخة.
+
+        العام يحتاج load ولا global_cube قبلو.
+        """
+        with self.lock:
+            if title is not None:
+                return self._sheet_cube(title)
+            if self._cube is None or self._cube[0] != self.version:
+                cubes = [self._sheet_cube(t) for _, t in self.sheets or []]
+                self._cube = (
+                    self.version,
+                    pd.concat(cubes, ignore_index=True) if cubes else self._sheet_cube(""),
+                )
+                if self.track_memory:
+                    self.mem_report["stats cube"] = frame_mb(self._cube[1])
+            return self._cube[1]
+
+    def client_index(self, title: str):
+        """فهرس الـ picker لورقة، يتبنى من جديد كان الـ frame تبدّل."""
+        with self.lock:
+            entry = self.frames.get(title)
+            if entry is None:
+                return None
+            cached = self._client_idx.get(title)
+            if cached is None or cached[0] is not entry[1]:
+                cached = (entry[1], build_client_index(entry[1]))
+                self._client_idx[title] = cached
+            return cached[1]
+
+    # ---------- write-through: نطبّقو الكتابة على الكاش بلا ما نعاودو نقراو ----------
+    def _replace(self, title: str, df: pd.DataFrame):
+        self._set_frame(title, self.frames[title][0], derive_columns(df))
+        self.version += 1
+
+    def apply_append(self, title: str, row_values: list, sheet_row: int | None = None):
+        """sheet_row: الصف اللي رجّعو append_row؛ لو موش آخر الكاش → تضارب → refetch."""
+        with self.lock:
+            entry = self.frames.get(title)
+            if entry is None:
+                if title in self.phones_at:  # مفهرسة من عمود الهاتف: نعاودو نقراوه
+                    self.invalidate(title)
+                return
+            df = entry[1]
+            if sheet_row is not None and sheet_row != len(df) + 2:
+                self.invalidate(title)
+                return
+            new = derive_columns(rows_to_frame(title, [EXPECTED_HEADERS, list(row_values)]))
+            self.frames[title] = (
+                entry[0],
+                pd.concat([df, new[df.columns]], ignore_index=True),
+            )
+            ph = new["Téléphone_norm"].iat[0]
+            rows = self.rows.setdefault(title, {})
+            if ph and ph not in rows:
+                rows[ph] = len(df) + 2
+                self.phone_index.setdefault(ph, (title, len(df) + 2))
+            self.version += 1
+
+    def apply_update(
+        self, title: str, phone: str, updates: dict, sheet_row: int | None = None
+    ):
+        """updates: {اسم العمود: القيمة الجديدة} للعميل صاحب الهاتف phone."""
+        with self.lock:
+            cached_row = self.sheet_row(title, phone)
+            if (
+                cached_row is None
+                or title not in self.frames
+                or (sheet_row is not None and sheet_row != cached_row)
+            ):
+                self.invalidate(title)
+                return
+            df = self.frames[title][1].copy()
+            for col, val in updates.items():
+                df.iat[cached_row - 2, df.columns.get_loc(col)] = val
+            self._replace(title, df)
+
+    def apply_delete(self, title: str, phone: str, sheet_row: int | None = None):
+        """بعد delete_rows: نحيو الصف ونعاودو نرقّمو الفهرس متاع الورقة."""
+        with self.lock:
+            cached_row = self.sheet_row(title, phone)
+            if (
+                cached_row is None
+                or title not in self.frames
+                or (sheet_row is not None and sheet_row != cached_row)
+            ):
+                self.invalidate(title)
+                return
+            entry = self.frames[title]
+            df = entry[1].drop(index=entry[1].index[cached_row - 2]).reset_index(drop=True)
+            self._set_frame(title, entry[0], df)
+            self.version += 1
+
+def find_client_row(
+    storage, title: str, phone: str, store: SheetStore
+) -> tuple[int | None, list[str]]:
+    """(رقم الصف، قيم الصف): O(1) من الفهرس + قراية صف واحد للتأكيد قبل الكتابة.
+
+    لو الفهرس ما يطابقش الورقة → نرجعو للمسح الكامل ونبطّلو كاش الورقة.
+    """
+    row_idx = store.sheet_row(title, phone)
+    if row_idx is not None:
+        row_vals = storage.row_values(title, row_idx)
+        if len(row_vals) > TEL_COL and normalize_tn_phone(row_vals[TEL_COL]) == phone:
+            return row_idx, row_vals
+
+    store.invalidate(title)
+    if isinstance(storage, SqliteStorage):
+        # query مفهرسة على phone بدل المسح
+        rows = [r for t, r in storage.phone_locations(phone) if t == title]
+        if rows:
+            return min(rows), storage.row_values(title, min(rows))
+        return None, []
+    return find_phone_row(storage.read_sheets([title]).get(title, []), phone)
+
+def move_client(
+    storage, src: str, dst: str, phone: str, store: SheetStore, reassign_by: str | None = None
+) -> list[str] | None:
+    """ينقل عميل من src لـ dst: قراية صف واحد (تأكيد) + move_row واحد.
+
+    reassign_by: لو موجود، نبدّلو Employe لـ dst ونكتبو في REASSIGN_LOG_SHEET في نفس الطلب.
+    None = العميل موش في src (مثلاً تنقل قبل، كليك ثاني) → ما نعملو شي.
+    كيما أي كتابة، اللي يعيّط (الواجهة) يعمل storage_written() بعدها.
+    """
+    row_idx, row_values = find_client_row(storage, src, phone, store)
+    if not row_idx:
+        return None
+    row_values = (list(row_values) + [""] * len(EXPECTED_HEADERS))[: len(EXPECTED_HEADERS)]
+    log_values = None
+    if reassign_by is not None:
+        row_values[EXPECTED_HEADERS.index("Employe")] = dst
+        storage.ensure_sheet(REASSIGN_LOG_SHEET, REASSIGN_LOG_HEADERS)
+        log_values = [
+            datetime.now(timezone.utc).isoformat(),
+            reassign_by,
+            src,
+            dst,
+            row_values[0],
+            normalize_tn_phone(row_values[TEL_COL]),
+        ]
+    storage.move_row(
+        src, row_idx, dst, row_values,
+        REASSIGN_LOG_SHEET if log_values else None, log_values,
+    )
+    store.apply_delete(src, phone, sheet_row=row_idx)
+    store.apply_append(dst, row_values)
+    return row_values
+
+def search_phone(storage, phone: str, store: SheetStore) -> pd.DataFrame:
+    """صفوف phone في كل الأوراق المفهرسة (موظّفين + أرشيف).
+
+    ورقة محمّلة → من الـ frame؛ ورقة مفهرسة من عمود الهاتف برك → قراية الصف
+    (مؤكّد بـ find_client_row) + الـ header.
+    """
+    with store.lock:
+        titles = [t for t, rows in store.rows.items() if phone in rows]
+        loaded = {t: store.frames[t][1] for t in titles if t in store.frames}
+    found = []
+    for title in titles:
+        df = loaded.get(title)
+        if df is not None:
+            found.append(df[df["Téléphone_norm"] == phone])
+            continue
+        row_idx, vals = find_client_row(storage, title, phone, store)
+        if row_idx:
+            header = storage.row_values(title, 1)
+            found.append(derive_columns(rows_to_frame(title, [header, vals])))
+    if not found:
+        return derive_columns(rows_to_frame("", [EXPECTED_HEADERS]))
+    return pd.concat(found, ignore_index=True)
+
+def parse_log_ts(s: pd.Series) -> pd.Series:
+    """timestamps ISO (UTC) → الوقت المحلّي، vectorized."""
+    try:
+        ts = pd.to_datetime(s, utc=True, errors="coerce", format="ISO8601")
+    except (TypeError, ValueError):  # pandas < 2
+        ts = pd.to_datetime(s, utc=True, errors="coerce")
+    return ts.dt.tz_convert(datetime.now().astimezone().tzinfo)
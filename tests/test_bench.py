@@ -0,0 +1,61 @@
+import json
+
+from megacrm_bench import FakeBackend, FakeSpreadsheet, run_benchmarks, synth_sheets
+from megacrm_core import (
+    ARCHIVE_SUFFIX, EXPECTED_HEADERS, SheetStore, SheetsGateway, SheetsStorage,
+    move_client, use_gateway,
+)
+
+def fake_storage(n_emp=2, n_clients=50):
+    backend = FakeBackend()
+    sheets = synth_sheets(n_emp, n_clients)
+    return backend, sheets, SheetsStorage(FakeSpreadsheet(backend, sheets))
+
+def test_rerun_memory_within_limit():
+    res = run_benchmarks(2, 300)
+    rerun = next(r for r in res if r["bench"] == "full rerun (read path)")
+    assert rerun["ok"] is True
+    assert rerun["peak_mb"] <= rerun["limit_mb"]
+    phones = next(r for r in res if r["bench"].startswith("normalize phones (apply"))
+    assert phones["same_result"] is True
+    json.dumps(res)  # التصدير JSON lines
+
+def test_load_on_fake_backend():
+    backend, sheets, storage = fake_storage()
+    with use_gateway(SheetsGateway(read_per_min=None, write_per_min=None)):
+        store = SheetStore()
+        emps = store.load(storage)
+    assert sorted(emps) == sorted(sheets)
+    assert sum(len(store.frames[t][1]) for t in emps) == sum(len(rows) - 1 for rows in sheets.values())
+    assert backend.calls["values_batch_get"] == 1
+
+def test_archive_round_trip():
+    _, sheets, storage = fake_storage()
+    src = next(iter(sheets))
+    archive = f"{src}{ARCHIVE_SUFFIX}"
+    store = SheetStore()
+    with use_gateway(SheetsGateway(read_per_min=None, write_per_min=None)):
+        store.load(storage)
+        phone = store.frames[src][1]["Téléphone_norm"].iloc[0]
+        storage.ensure_sheet(archive, EXPECTED_HEADERS)
+        store.frame(storage, archive)
+        assert move_client(storage, src, archive, phone, store) is not None
+        assert move_client(storage, src, archive, phone, store) is None  # كليك ثاني
+        assert store.sheet_row(archive, phone) == 2
+        assert move_client(storage, archive, src, phone, store) is not None
+        assert store.sheet_row(archive, phone) is None
+        assert phone in set(store.frame(storage, src)["Téléphone_norm"])
+
+def test_global_cube_without_frames():
+    _, sheets, storage = fake_storage(n_emp=3)
+    src = next(iter(sheets))
+    admin, emp = SheetStore(), SheetStore()
+    with use_gateway(SheetsGateway(read_per_min=None, write_per_min=None)):
+        admin.load(storage)
+        emp.load_employee(storage, src)
+        cube = emp.global_cube(storage)
+    assert set(emp.frames) == {src}  # أوراق الآخرين: cube + فهرس الهاتف برك
+    assert set(cube["__sheet_name"]) == set(sheets)
+    cols = ["Clients", "Inscrits", "Alerts"]
+    assert cube[cols].sum().tolist() == admin.stats_cube()[cols].sum().tolist()
+    assert len(emp.phone_index) == len(admin.phone_index)
@@ -0,0 +1,40 @@
+import gspread.exceptions as gse
+import pytest
+
+import megacrm_core
+from megacrm_bench import FakeBackend, FakeResponse, FakeSpreadsheet, synth_sheets
+from megacrm_core import SheetStore, SheetsGateway, SheetsStorage, use_gateway
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(megacrm_core.time, "sleep", lambda s: None)
+
+def test_load_survives_quota_errors():
+    backend = FakeBackend(fail_every=2)
+    sheets = synth_sheets(2, 20)
+    gateway = SheetsGateway(read_per_min=None, write_per_min=None)
+    with use_gateway(gateway):
+        emps = SheetStore().load(SheetsStorage(FakeSpreadsheet(backend, sheets)))
+    assert sorted(emps) == sorted(sheets)
+    assert sum(gateway.retries.values()) == backend.n // 2 > 0  # كل 429 تعاودت
+    assert not gateway.errors
+
+def test_append_not_retried_on_5xx():
+    calls = []
+
+    def server_error(*args, **kwargs):
+        calls.append(args)
+        raise gse.APIError(FakeResponse(500))
+
+    gateway = SheetsGateway(read_per_min=None, write_per_min=None)
+    with pytest.raises(gse.APIError):
+        gateway.call("append_row", server_error, ["x"])
+    assert len(calls) == 1  # 5xx ينجم يكون تطبّق: ما نعاودوش
+    assert gateway.retries["append_row"] == 0
+    assert gateway.errors["append_row"] == 1
+
+    calls.clear()
+    with pytest.raises(gse.APIError):
+        gateway.call("batch_update", server_error, [])
+    assert len(calls) == megacrm_core.SHEETS_RETRIES  # موش append: يتعاود
+    assert gateway.retries["batch_update"] == megacrm_core.SHEETS_RETRIES - 1
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from megacrm_core import (
+    build_client_index, normalize_tn_phone, normalize_tn_phone_series, search_client_index,
+)
+
+CASES = [
+    None,
+    np.nan,
+    pd.NA,
+    "",
+    "   ",
+    "22 123 456",
+    "22123456",
+    "+216 22 123 456",
+    "0021622123456",
+    "00 216 22-123-456",
+    "21622123456",
+    "(+216) 22.123.456",
+    "٢٢١٢٣٤٥٦",  # أرقام عربية
+    "+٢١٦ ٢٢ ١٢٣ ٤٥٦",
+    "۲۲۱۲۳۴۵۶",  # أرقام فارسية
+    "22 123 456 ext 7",
+    "1234567",
+    "phone: 9876543",
+]
+
+def test_series_matches_scalar():
+    s = pd.Series(CASES, dtype=object)
+    assert normalize_tn_phone_series(s).tolist() == [normalize_tn_phone(v) for v in CASES]
+
+def test_series_matches_scalar_on_strings():
+    strings = [v for v in CASES if isinstance(v, str)]
+    got = normalize_tn_phone_series(pd.Series(strings)).tolist()
+    assert got == [normalize_tn_phone(v) for v in strings]
+
+def test_missing_values_are_empty():
+    got = normalize_tn_phone_series(pd.Series([None, np.nan, "22123456"]))
+    assert got.tolist() == ["", "", "21622123456"]
+
+def test_plus_and_double_zero_prefixes():
+    # 00216 يبقى كيف ما هو (الدالة العادية ما تنحّيش 00)؛ المهم الزوز متطابقين
+    for raw in ["+21622123456", "0021622123456"]:
+        assert normalize_tn_phone_series(pd.Series([raw])).iat[0] == normalize_tn_phone(raw)
+
+def test_search_phone_with_separators():
+    df = pd.DataFrame({
+        "Nom & Prénom": ["Ali Ben Salah", "Sami Trabelsi"],
+        "Téléphone_norm": ["21622123456", "21698765432"],
+    })
+    tokens, _ = build_client_index(df)
+    for query in ["22 123 456", "22123456", "+216 22 123 456", "0021622123456",
+                  "(+216) 22.123.456", "00 216 22-123", "22 12"]:
+        assert search_client_index(tokens, query) == ["21622123456"], query
+    assert search_client_index(tokens, "ali 22") == ["21622123456"]
+    assert search_client_index(tokens, "22 987") == []
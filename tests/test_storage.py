@@ -0,0 +1,147 @@
+import threading
+import time
+
+import gspread
+import pytest
+
+from megacrm_bench import FakeBackend, FakeSpreadsheet
+from megacrm_core import (
+    EXPECTED_HEADERS, REASSIGN_LOG_HEADERS, REASSIGN_LOG_SHEET, SheetStore, SheetsGateway,
+    SheetsStorage, SheetsSync, SheetsWriter, SqliteStorage, use_gateway,
+)
+
+def client_row(name, phone, emp):
+    row = [""] * len(EXPECTED_HEADERS)
+    row[0], row[1], row[EXPECTED_HEADERS.index("Employe")] = name, phone, emp
+    return row
+
+def two_sheets():
+    return {
+        t: [list(EXPECTED_HEADERS)] + [client_row(f"{t} {i}", f"216{k}000000{i}", t) for i in range(3)]
+        for k, t in ((2, "A"), (3, "B"))
+    }
+
+def test_writer_drains_only_the_sheet_being_read():
+    sh = FakeSpreadsheet(FakeBackend(), two_sheets())
+    remote = SheetsStorage(sh)
+    release = threading.Event()
+    flush = remote.update_ranges
+
+    def slow_update(title, grid):
+        release.wait(5)
+        flush(title, grid)
+
+    remote.update_ranges = slow_update
+    session = SheetsStorage(sh, writer=SheetsWriter(remote, SheetStore()), shared=remote)
+    session.update_cells("A", 2, {6: "note"})
+
+    t0 = time.time()
+    assert session.row_values("B", 2)[1] == "21630000000"  # ورقة أخرى
+    assert session.row_values("A", 3)[1] == "21620000001"  # نفس الورقة، صف آخر
+    assert time.time() - t0 < 1
+
+    threading.Timer(0.3, release.set).start()
+    t0 = time.time()
+    assert session.row_values("A", 2)[5] == "note"  # الصف اللي فيه كتابة: نستنّاو
+    assert time.time() - t0 >= 0.25
+
+@pytest.fixture
+def synced():
+    """(SQLite محلي، الـ spreadsheet الوهمي، SheetsSync) بعد أول pull."""
+    sheets = two_sheets()
+    sheets["A_PAIEMENTS"] = [["Montant"], ["100"]]
+    sheets[REASSIGN_LOG_SHEET] = [list(REASSIGN_LOG_HEADERS)]
+    sh = FakeSpreadsheet(FakeBackend(), sheets)
+    local = SqliteStorage(":memory:")
+    sync = SheetsSync(local, SheetsStorage(sh), SheetStore())
+    with use_gateway(SheetsGateway(read_per_min=None, write_per_min=None)):
+        sync.pull()
+        yield local, sh, sync
+
+def remote_rows(sh, title):
+    return sh._ws[title].rows
+
+def test_pull_mirrors_crm_sheets_only(synced):
+    local, _, _ = synced
+    assert sorted(local.list_sheets()) == ["A", "B", REASSIGN_LOG_SHEET]
+
+def test_update_cells_missing_row_raises(synced):
+    local, _, _ = synced
+    with pytest.raises(IndexError):
+        local.update_cells("A", 99, {6: "x"})
+    assert local.last_row("A") == 4
+    assert local.outbox_items() == []
+
+def test_delete_renumbers_rows_below(synced):
+    local, _, _ = synced
+    local.delete_row("A", 2)
+    assert local.last_row("A") == 3
+    assert local.row_values("A", 2)[1] == "21620000001"
+    assert local.phone_locations("21620000002") == [("A", 3)]
+
+def test_move_row_is_one_transaction(synced):
+    local, _, _ = synced
+    row = local.row_values("A", 2)
+    with pytest.raises(gspread.WorksheetNotFound):
+        local.move_row("A", 2, "B", row, "Missing_Log", ["x"])  # السجلّ موش موجود
+    assert local.row_values("A", 2) == row
+    assert local.last_row("B") == 4
+    assert local.outbox_items() == []
+
+    local.move_row("A", 2, "B", row, REASSIGN_LOG_SHEET, ["t", "me", "A", "B", row[0], row[1]])
+    assert local.phone_locations("21620000000") == [("B", 5)]
+    assert local.last_row(REASSIGN_LOG_SHEET) == 2
+    assert [op for _, op, _, _ in local.outbox_items()] == ["move_row"]
+
+def test_push_confirms_row_by_phone(synced):
+    local, sh, sync = synced
+    local.update_cells("A", 3, {6: "local note"})
+    del remote_rows(sh, "A")[1]  # صف تنحّى فوقو في Google Sheets
+    assert sync.push() == 1
+    assert remote_rows(sh, "A")[1][1] == "21620000001"
+    assert remote_rows(sh, "A")[1][5] == "local note"
+
+def test_push_skips_client_gone_remotely(synced):
+    local, sh, sync = synced
+    local.update_cells("A", 2, {6: "local note"})
+    del remote_rows(sh, "A")[1]
+    before = [list(r) for r in remote_rows(sh, "A")]
+    assert sync.push() == 0
+    assert sync.skipped["update_cells"] == 1
+    assert remote_rows(sh, "A") == before
+    assert local.outbox_items() == []
+
+def test_pull_leaves_dirty_sheets_alone(synced):
+    local, sh, sync = synced
+    local.update_cells("A", 2, {6: "local note"})
+    remote_rows(sh, "A")[1][5] = "remote note"
+    remote_rows(sh, "B")[1][5] = "remote note"
+    sync.pull()
+    assert local.row_values("A", 2)[5] == "local note"
+    assert local.row_values("B", 2)[5] == "remote note"
+
+def log_sheet(n):
+    days = [f"2026-{1 + i // 28:02d}-{1 + i % 28:02d}T10:00:00+00:00" for i in range(n)]
+    return [list(REASSIGN_LOG_HEADERS)] + [[d, "me", "A", "B", "x", "216"] for d in days]
+
+def test_log_bounds_with_bounded_probes():
+    backend = FakeBackend()
+    sh = FakeSpreadsheet(backend, {REASSIGN_LOG_SHEET: log_sheet(300)})
+    sh._ws[REASSIGN_LOG_SHEET].row_count = 5000  # grid فيه صفوف فارغة في الآخر
+    storage = SheetsStorage(sh)
+    local = SqliteStorage(":memory:")
+    local.replace_sheet(REASSIGN_LOG_SHEET, log_sheet(300))
+    with use_gateway(SheetsGateway(read_per_min=None, write_per_min=None)):
+        assert storage.last_row(REASSIGN_LOG_SHEET) == local.last_row(REASSIGN_LOG_SHEET) == 301
+        assert backend.calls["values_batch_get"] <= 3
+        assert backend.calls["values_get"] == 0  # العمود ما تقراش كامل
+
+        sh._ws[REASSIGN_LOG_SHEET].rows.append(["2026-12-01T00:00:00+00:00"])
+        assert storage.last_row(REASSIGN_LOG_SHEET) == 302
+        assert backend.calls["values_get"] == 1
+
+        calls = sum(backend.calls.values())
+        for prefix, expected in [("2026-03-05", 62), ("2025-01-01", 2), ("2027-01-01", 302)]:
+            assert storage.first_row_from(REASSIGN_LOG_SHEET, prefix, 301) == expected
+            assert local.first_row_from(REASSIGN_LOG_SHEET, prefix, 301) == expected
+        assert sum(backend.calls.values()) - calls <= 3 * 2